@@ -4,10 +4,16 @@ Takes an S3 image, runs RetinaFace detection + ArcFace embedding (buffalo_l),
 returns each face's bbox, detection score, pose, and a 512-d L2-normalized
 embedding. The PhotoAura backend calls /embed instead of AWS Rekognition;
 clustering + matching happen in Postgres via pgvector.
+
+/embed/batch takes a list of keys: S3 fetch + decode run concurrently on a
+thread pool, and the ArcFace recognizer sees every face of a micro-batch of
+images in one forward pass instead of one call per face.
 """
 
+import base64
 import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import cv2
@@ -16,6 +22,8 @@ from fastapi import FastAPI, HTTPException
 from PIL import Image
 from pydantic import BaseModel
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
 
 app = FastAPI(title="photoaura-faces")
 
@@ -26,6 +34,12 @@ _face = FaceAnalysis(
 )
 # ctx_id=0 -> first GPU; det_size is the detector input resolution
 _face.prepare(ctx_id=0, det_size=(640, 640))
+_rec = _face.models["recognition"]
+
+# images per GPU micro-batch, and concurrent S3 fetch/decode workers feeding it
+_BATCH = int(os.environ.get("FACE_BATCH", "8"))
+_FETCH_WORKERS = int(os.environ.get("FACE_FETCH_WORKERS", "8"))
+_fetch_pool = ThreadPoolExecutor(max_workers=_FETCH_WORKERS)
 
 _s3 = boto3.client(
     "s3",
@@ -38,6 +52,15 @@ _s3 = boto3.client(
 class EmbedRequest(BaseModel):
     bucket: str
     key: str
+    # return a JPEG crop for every face at least this many px on its short
+    # side — the backend's chip candidates — so it never re-downloads the photo
+    chip_min_px: int | None = None
+
+
+class EmbedBatchRequest(BaseModel):
+    bucket: str
+    keys: list[str]
+    chip_min_px: int | None = None
 
 
 # insightface 2d106 mesh: contiguous point groups for each eye contour
@@ -85,27 +108,74 @@ def health():
     return {"ok": True, "model": _MODEL}
 
 
-@app.post("/embed")
-def embed(req: EmbedRequest):
+def _load(bucket, key):
+    """S3 GET + decode. Returns (PIL RGB image, BGR array); raises ValueError
+    with the stage that failed so the caller can report it per key."""
     try:
-        obj = _s3.get_object(Bucket=req.bucket, Key=req.key)
+        obj = _s3.get_object(Bucket=bucket, Key=key)
         data = obj["Body"].read()
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"s3 fetch failed: {e}")
-
+        raise ValueError(f"s3 fetch failed: {e}")
     try:
         img = Image.open(io.BytesIO(data)).convert("RGB")
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"image decode failed: {e}")
-
+        raise ValueError(f"image decode failed: {e}")
     # insightface expects BGR
-    arr = np.asarray(img)[:, :, ::-1]
-    faces = _face.get(arr)
+    return img, np.asarray(img)[:, :, ::-1]
+
+
+def _analyze(arrs):
+    """FaceAnalysis.get() for a micro-batch of images. Detection and the
+    landmark/pose heads still run per image (inputs differ in size), but every
+    aligned face crop across the batch goes through the recognizer together."""
+    per_image, crops, owners = [], [], []
+    for arr in arrs:
+        bboxes, kpss = _face.det_model.detect(arr, max_num=0, metric="default")
+        faces = []
+        for i in range(bboxes.shape[0]):
+            f = Face(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4],
+            )
+            for taskname, model in _face.models.items():
+                if taskname in ("detection", "recognition"):
+                    continue
+                model.get(arr, f)
+            crops.append(
+                face_align.norm_crop(arr, landmark=f.kps, image_size=_rec.input_size[0])
+            )
+            owners.append(f)
+            faces.append(f)
+        per_image.append(faces)
+
+    for start in range(0, len(crops), 64):
+        feats = _rec.get_feat(crops[start:start + 64])
+        for f, feat in zip(owners[start:start + 64], feats):
+            f.embedding = feat.flatten()
+    return per_image
+
+
+def _chip(img, bbox, pad=0.2):
+    """Padded face crop as base64 JPEG — same framing as the backend's _crop,
+    cut from the image we already decoded."""
+    x1, y1, x2, y2 = bbox
+    w, h = x2 - x1, y2 - y1
+    left = max(0, int(x1 - w * pad))
+    top = max(0, int(y1 - h * pad))
+    right = min(img.width, int(x2 + w * pad))
+    bottom = min(img.height, int(y2 + h * pad))
+    buf = io.BytesIO()
+    img.crop((left, top, right, bottom)).save(buf, format="JPEG")
+    return base64.b64encode(buf.getvalue()).decode()
 
+
+def _faces_json(img, arr, faces, chip_min_px=None):
     out = []
     for f in faces:
         x1, y1, x2, y2 = (int(v) for v in f.bbox)
         pose = getattr(f, "pose", None)
+        want_chip = chip_min_px is not None and min(x2 - x1, y2 - y1) >= chip_min_px
         out.append({
             "bbox": [x1, y1, x2, y2],
             "det_score": float(f.det_score),
@@ -116,6 +186,59 @@ def embed(req: EmbedRequest):
             "pitch": float(pose[0]) if pose is not None else 0.0,
             "roll": float(pose[2]) if pose is not None else 0.0,
             "eye_open": _eye_open(f),
+            "chip": _chip(img, [x1, y1, x2, y2]) if want_chip else None,
         })
+    return out
+
 
-    return {"img_w": img.width, "img_h": img.height, "faces": out}
+@app.post("/embed")
+def embed(req: EmbedRequest):
+    try:
+        img, arr = _load(req.bucket, req.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    faces = _analyze([arr])[0]
+    return {
+        "img_w": img.width,
+        "img_h": img.height,
+        "faces": _faces_json(img, arr, faces, req.chip_min_px),
+    }
+
+
+@app.post("/embed/batch")
+def embed_batch(req: EmbedBatchRequest):
+    """Many keys per call. Results come back in request order; a key that
+    failed to fetch/decode gets an "error" instead of failing the batch.
+    Only the next micro-batch is prefetched, so decoded frames held in memory
+    stay bounded at ~2 x FACE_BATCH images however many keys are sent."""
+    keys = req.keys
+    results = [None] * len(keys)
+    batches = [range(s, min(s + _BATCH, len(keys))) for s in range(0, len(keys), _BATCH)]
+
+    def _submit(idx):
+        return [(i, _fetch_pool.submit(_load, req.bucket, keys[i])) for i in idx]
+
+    pending = _submit(batches[0]) if batches else []
+    for n in range(len(batches)):
+        current = pending
+        pending = _submit(batches[n + 1]) if n + 1 < len(batches) else []
+        ready = []  # (index, img, arr) for this micro-batch
+        for i, fut in current:
+            try:
+                img, arr = fut.result()
+            except ValueError as e:
+                results[i] = {"key": keys[i], "error": str(e)}
+                continue
+            ready.append((i, img, arr))
+        if not ready:
+            continue
+        for (i, img, arr), faces in zip(ready, _analyze([r[2] for r in ready])):
+            results[i] = {
+                "key": keys[i],
+                "img_w": img.width,
+                "img_h": img.height,
+                "faces": _faces_json(img, arr, faces, req.chip_min_px),
+            }
+        del ready, current
+    return {"results": results}
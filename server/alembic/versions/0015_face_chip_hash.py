@@ -0,0 +1,28 @@
+"""add face_data.chip_hash
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-18
+
+Fingerprint of what a person's key chip (faces/{external_id}.jpg) was cropped
+from — source photo, its upload_date and the face box. Reclustering compares
+it instead of HEAD-ing every chip in S3, and only re-crops chips that changed.
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0015"
+down_revision: Union[str, None] = "0014"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("face_data", sa.Column("chip_hash", sa.String(64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("face_data", "chip_hash")
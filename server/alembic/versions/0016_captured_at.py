@@ -0,0 +1,89 @@
+"""add file_metadata.captured_at
+
+Revision ID: 0016
+Revises: 0015
+Create Date: 2026-10-18
+
+When the shot was taken — EXIF DateTimeOriginal (then DateTime), falling back
+to upload_date — stored once instead of being re-parsed out of exif_data on
+every request. Backfilled here in batches; ingest fills it for new uploads
+(image_utils.exif_capture_time). Indexed (captured_at, id) for the
+keyset-paginated /api/photos/ feed.
+"""
+
+import json
+from datetime import datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0016"
+down_revision: Union[str, None] = "0015"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 2000
+
+
+def _captured_at(exif_data, upload_date):
+    raw = exif_data
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except Exception:
+            raw = {}
+    if isinstance(raw, dict):
+        dt = raw.get("DateTimeOriginal") or raw.get("DateTime")
+        if dt:
+            try:
+                return datetime.strptime(str(dt), "%Y:%m:%d %H:%M:%S")
+            except Exception:
+                pass
+    return upload_date or datetime.min
+
+
+def upgrade() -> None:
+    op.add_column("file_metadata", sa.Column("captured_at", sa.TIMESTAMP(), nullable=True))
+
+    bind = op.get_bind()
+    fm = sa.table(
+        "file_metadata",
+        sa.column("id", sa.Integer()),
+        sa.column("exif_data", sa.JSON()),
+        sa.column("upload_date", sa.TIMESTAMP()),
+        sa.column("captured_at", sa.TIMESTAMP()),
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(fm.c.id, fm.c.exif_data, fm.c.upload_date)
+            .where(fm.c.id > last_id)
+            .order_by(fm.c.id)
+            .limit(BATCH)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            fm.update()
+            .where(fm.c.id == sa.bindparam("pid"))
+            .values(captured_at=sa.bindparam("at")),
+            [{"pid": r.id, "at": _captured_at(r.exif_data, r.upload_date)} for r in rows],
+        )
+        last_id = rows[-1].id
+
+    # every row has a value now; new rows without one default to insert time
+    op.alter_column(
+        "file_metadata",
+        "captured_at",
+        nullable=False,
+        server_default=sa.text("CURRENT_TIMESTAMP"),
+    )
+    op.create_index(
+        "ix_file_metadata_captured_at", "file_metadata", ["captured_at", "id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_file_metadata_captured_at", table_name="file_metadata")
+    op.drop_column("file_metadata", "captured_at")
@@ -0,0 +1,31 @@
+"""index file_metadata (album_id, captured_at, id)
+
+Revision ID: 0017
+Revises: 0016
+Create Date: 2026-10-18
+
+Album, share and category galleries list one album's photos in capture order.
+With this index Postgres reads them straight off the index in either
+direction instead of the API sorting every row in Python per request.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0017"
+down_revision: Union[str, None] = "0016"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_file_metadata_album_captured_at",
+        "file_metadata",
+        ["album_id", "captured_at", "id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_file_metadata_album_captured_at", table_name="file_metadata")
@@ -0,0 +1,29 @@
+"""index photo_face_link (face_id, id)
+
+Revision ID: 0018
+Revises: 0017
+Create Date: 2026-10-18
+
+/api/faces pages through people first and only then gathers their links;
+this index serves both the "has a visible link" check per person and the
+per-person link list in id order, instead of a scan of every link.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0018"
+down_revision: Union[str, None] = "0017"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_photo_face_link_face_id", "photo_face_link", ["face_id", "id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_photo_face_link_face_id", table_name="photo_face_link")
@@ -34,6 +34,9 @@ class Settings:
     )
     
     DATA_DIR: str = os.environ.get("DATA_DIR", "/var/aura/data")
+    # job checkpoints and other server-side state; unlike DATA_DIR, never
+    # served over /api/static
+    STATE_DIR: str = os.environ.get("STATE_DIR", "/var/aura/state")
     
     CORS_ORIGINS: list[str] = os.environ.get("CORS_ORIGINS", "*").split(",")
 
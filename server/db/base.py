@@ -1,6 +1,7 @@
 from contextlib import contextmanager
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 from config import settings
@@ -14,6 +15,20 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
+# same database through psycopg's async driver, for async def routes: their
+# queries are awaited instead of blocking the event loop (and with it the
+# websocket progress feeds and liveness probe). Own pool, same sizing.
+async_engine = create_async_engine(
+    settings.DATABASE_URL,
+    pool_size=10,
+    max_overflow=5,
+    pool_pre_ping=True,
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 class Base(DeclarativeBase):
     pass
@@ -32,6 +47,19 @@ def get_session():
         session.close()
 
 
+async def get_async_session():
+    """get_session for async def routes: yields an AsyncSession, commits on
+    success, rolls back on error. Attributes aren't lazy-loaded on an
+    AsyncSession — select the columns (or joins) the route needs."""
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
 @contextmanager
 def session_scope():
     """Context manager for session use outside of request handlers."""
@@ -102,6 +102,10 @@ class FileMetadata(Base):
     width: Mapped[Optional[int]] = mapped_column(Integer)
     height: Mapped[Optional[int]] = mapped_column(Integer)
     upload_date: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    # EXIF capture time (falls back to upload_date); what every gallery sorts by
+    captured_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP, server_default=text("CURRENT_TIMESTAMP")
+    )
     exif_data: Mapped[Optional[Any]] = mapped_column(JSON)
     blur_data_url: Mapped[Optional[str]] = mapped_column(Text)
     orientation: Mapped[Optional[str]] = mapped_column(String(10))
@@ -190,6 +194,9 @@ class FaceData(Base):
     external_id: Mapped[Optional[str]] = mapped_column(String(255), unique=True)
     # quality of the chosen key-face crop (faces/{external_id}.jpg); higher = better
     key_score: Mapped[Optional[float]] = mapped_column(Float)
+    # fingerprint of the chip's source (photo key, upload_date, box); unchanged
+    # hash -> the stored chip is still right and reclustering skips it
+    chip_hash: Mapped[Optional[str]] = mapped_column(String(64))
 
 
 class PhotoFaceLink(Base):
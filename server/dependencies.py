@@ -1,12 +1,21 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Literal, Optional
 import jwt
+import os
 from config import settings
 from db.base import get_session
+from services import cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# same, but lets requests without a token through (share-link viewers)
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# how long a user's role + album grants are trusted without re-reading them;
+# the user/permission endpoints invalidate explicitly, this bounds the rest
+AUTHZ_CACHE_TTL = int(os.environ.get("AUTHZ_CACHE_TTL", "60"))
+_authz = cache.namespace("authz", ttl=AUTHZ_CACHE_TTL)
 
 
 class TokenData:
@@ -26,13 +35,68 @@ def verify_token(token: str, credentials_exception: HTTPException) -> TokenData:
         raise credentials_exception
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    return verify_token(token, credentials_exception)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+    return verify_token(token, _credentials_exception())
+
+
+def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+) -> Optional[TokenData]:
+    """get_current_user for endpoints anonymous share-link viewers can also
+    reach: None without a token. A token that doesn't verify is still a 401."""
+    if not token:
+        return None
+    return verify_token(token, _credentials_exception())
+
+
+def user_access(session, user_name):
+    """{"id", "role", "albums"} for `user_name` — the live DB role and the
+    album ids they've been granted (empty for admins, who see everything).
+    None if there's no such user. Cached per user for AUTHZ_CACHE_TTL."""
+    access = _authz.get(user_name)
+    if access is not None:
+        return access
+    from db.models import User, UserAlbumPermission
+
+    since = _authz.version()
+    u = session.query(User.id, User.role).filter_by(user_name=user_name).first()
+    if not u:
+        return None
+    albums = ()
+    if u.role != "admin":
+        albums = [
+            r[0]
+            for r in session.query(UserAlbumPermission.album_id)
+            .filter_by(user_id=u.id)
+            .all()
+        ]
+    access = {"id": u.id, "role": u.role, "albums": frozenset(albums)}
+    return _authz.set(user_name, access, tags=[f"user:{u.id}"], since=since)
+
+
+async def user_access_async(session, user_name):
+    """user_access() for an AsyncSession — the same cached lookup, run via
+    run_sync so a miss's queries are awaited. A hit never opens a connection."""
+    return await session.run_sync(user_access, user_name)
+
+
+def invalidate_user_access(*user_ids):
+    """Call after committing a change to these users' role, name or album
+    grants."""
+    _authz.invalidate(*(f"user:{uid}" for uid in user_ids))
+
+
+def clear_user_access():
+    """After changes that touch many users' grants at once (album deletes)."""
+    _authz.clear()
 
 
 def require_admin(
@@ -42,12 +106,18 @@ def require_admin(
     # check the live DB role, not the role baked into the token at login —
     # so promoting a user to admin takes effect on their next request without
     # forcing a re-login.
-    from db.models import User
-
-    u = session.query(User).filter_by(user_name=current_user.user_name).first()
-    role = u.role if u else current_user.role
+    access = user_access(session, current_user.user_name)
+    role = access["role"] if access else current_user.role
     if role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     current_user.role = role
     return current_user
 
+
+def photo_fields(
+    fields: Literal["grid", "lightbox", "full"] = "full", lean: bool = False
+) -> str:
+    """Which photo projection a gallery endpoint returns (?fields=grid|
+    lightbox|full, see utils.utils.PHOTO_FIELDS). lean=true is the older
+    spelling of lightbox."""
+    return "lightbox" if lean and fields == "full" else fields
@@ -5,7 +5,7 @@ a service is down)."""
 import os
 
 import requests
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 
@@ -13,6 +13,7 @@ from config import settings
 from db.base import get_session
 from db.models import FileMetadata, Album, User, ClientFile, FaceData, FaceEmbedding
 from dependencies import require_admin
+from services import blur_backfill, cache
 
 router = APIRouter()
 
@@ -91,4 +92,32 @@ def ops(_admin=Depends(require_admin), session: Session = Depends(get_session)):
             "face_service": _reachable(f"{FACE_SERVICE_URL}/health"),
             "cdn": _cdn_ok(session),
         },
+        "cache": cache.stats(),
     }
+
+
+def _blur_backfill_task(workers: int, restart: bool):
+    try:
+        blur_backfill.run(workers=workers, restart=restart)
+    except Exception as e:
+        print(f"blur backfill failed: {e}")
+
+
+@router.post("/api/admin/backfill-blur")
+def start_blur_backfill(
+    background: BackgroundTasks,
+    workers: int = blur_backfill.BLUR_BACKFILL_WORKERS,
+    restart: bool = False,
+    _admin=Depends(require_admin),
+):
+    """Generate missing blur placeholders in the background, resuming from
+    the last checkpoint (restart=true starts over). Poll GET for progress."""
+    if blur_backfill.status()["running"]:
+        raise HTTPException(status_code=409, detail="Backfill already running")
+    background.add_task(_blur_backfill_task, max(1, workers), restart)
+    return {"message": "Blur backfill started"}
+
+
+@router.get("/api/admin/backfill-blur")
+def blur_backfill_status(_admin=Depends(require_admin)):
+    return blur_backfill.status()
@@ -1,11 +1,15 @@
-from fastapi import HTTPException, APIRouter, Depends
+from fastapi import HTTPException, APIRouter, Depends, Query, Request
+import base64
 import os
 import logging
 from pydantic import BaseModel
+from datetime import datetime
+from sqlalchemy import func, null, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from config import settings
-from db.base import get_session
+from db.base import get_async_session, get_session
 from db.models import (
     Album,
     FileMetadata,
@@ -16,168 +20,314 @@ from db.models import (
     FaceEmbedding,
     User,
 )
+from services import gallery_cache
 from services.aws_service import s3_client, invalidate_cdn
+from services.media_urls import presigned_get
 from botocore.exceptions import ClientError
-from utils.utils import create_album_photos_json, add_album_to_user, capture_time
-from dependencies import require_admin, get_current_user
+from utils.face_matcher import matcher
+from utils.fast_json import FastJSONResponse
+from utils.utils import (
+    build_photo_json,
+    create_album_photos_json,
+    add_album_to_user,
+    photo_columns,
+)
+from dependencies import (
+    clear_user_access,
+    get_current_user,
+    get_optional_user,
+    invalidate_user_access,
+    photo_fields,
+    require_admin,
+    user_access,
+    user_access_async,
+)
 
 router = APIRouter()
 AWS_BUCKET = settings.AWS_BUCKET
 AWS_CLOUDFRONT_URL = settings.AWS_CLOUDFRONT_URL
 
+# cover tiles shown per album in the album lists
+COVERS_PER_ALBUM = 4
+
+
+async def _album_covers(session, albums):
+    """{album_id: [photo json]} with up to COVERS_PER_ALBUM covers each, in
+    one ROW_NUMBER() OVER (PARTITION BY album_id) query. Only the columns a
+    tile needs are read; the heavy ones (exif JSON, blur, description, tags)
+    come back as NULL so build_photo_json keeps the usual shape."""
+    slugs = {a.id: a.slug for a in albums}
+    if not slugs:
+        return {}
+    ranked = (
+        select(
+            FileMetadata.id,
+            FileMetadata.album_id,
+            FileMetadata.filename,
+            FileMetadata.content_type,
+            FileMetadata.size,
+            FileMetadata.width,
+            FileMetadata.height,
+            FileMetadata.upload_date,
+            FileMetadata.orientation,
+            null().label("exif_data"),
+            null().label("blur_data_url"),
+            null().label("description"),
+            null().label("tags"),
+            func.row_number()
+            .over(partition_by=FileMetadata.album_id, order_by=FileMetadata.id)
+            .label("rn"),
+        )
+        .where(FileMetadata.album_id.in_(list(slugs)))
+        .subquery()
+    )
+    covers = {album_id: [] for album_id in slugs}
+    for row in await session.execute(
+        select(ranked)
+        .where(ranked.c.rn <= COVERS_PER_ALBUM)
+        .order_by(ranked.c.album_id, ranked.c.rn)
+    ):
+        covers[row.album_id].append(build_photo_json(row, slugs[row.album_id]))
+    return covers
+
 
 @router.get("/api/album/{album_slug}/")
 async def get_album(
     album_slug: str,
     secret: str = None,
     orientation: str = None,
-    session: Session = Depends(get_session),
+    fields: str = Depends(photo_fields),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    album = session.query(Album).filter_by(slug=album_slug).first()
+    """The album with its photos in capture order, projected to `fields`
+    (grid|lightbox|full)."""
+    album = await session.scalar(select(Album).filter_by(slug=album_slug))
 
     if album is None:
         raise HTTPException(status_code=404, detail="Album not found")
 
-    photos_query = session.query(FileMetadata).filter_by(album_id=album.id)
+    photos_query = select(*photo_columns(fields)).where(
+        FileMetadata.album_id == album.id
+    )
     if orientation:
-        photos_query = photos_query.filter_by(orientation=orientation)
-    file_metadata = photos_query.all()
+        photos_query = photos_query.where(FileMetadata.orientation == orientation)
+    file_metadata = (
+        await session.execute(
+            photos_query.order_by(FileMetadata.captured_at, FileMetadata.id)
+        )
+    ).all()
 
     if not file_metadata:
         raise HTTPException(status_code=404, detail="No images found in the album")
 
-    album_photos = create_album_photos_json(album_slug, file_metadata)
+    album_photos = create_album_photos_json(album_slug, file_metadata, fields)
 
-    permissions = (
-        session.query(UserAlbumPermission).filter_by(album_id=album.id).all()
+    permissions = await session.execute(
+        select(User.id, User.user_name, User.full_name, User.user_email)
+        .join(UserAlbumPermission, UserAlbumPermission.user_id == User.id)
+        .where(UserAlbumPermission.album_id == album.id)
+        .order_by(UserAlbumPermission.id)
+    )
+    permissions_list = [
+        {
+            "user_id": user.id,
+            "user_name": user.user_name,
+            "full_name": user.full_name,
+            "user_email": user.user_email,
+        }
+        for user in permissions
+    ]
+
+    return FastJSONResponse(
+        {
+            "album_id": album.id,
+            "album_name": album.name,
+            "slug": album.slug,
+            "image_count": album.image_count,
+            "shared": album.shared,
+            "upload": album.upload,
+            "secret": album.secret,
+            "public": bool(album.public),
+            "face_detection": album.face_detection,
+            "album_permissions": permissions_list,
+            "album_photos": album_photos,
+        }
     )
-    permissions_list = []
-    for perm in permissions:
-        user = session.get(User, perm.user_id)
-        if user:
-            permissions_list.append(
-                {
-                    "user_id": user.id,
-                    "user_name": user.user_name,
-                    "full_name": user.full_name,
-                    "user_email": user.user_email,
-                }
-            )
-
-    return {
-        "album_id": album.id,
-        "album_name": album.name,
-        "slug": album.slug,
-        "image_count": album.image_count,
-        "shared": album.shared,
-        "upload": album.upload,
-        "secret": album.secret,
-        "public": bool(album.public),
-        "face_detection": album.face_detection,
-        "album_permissions": permissions_list,
-        "album_photos": album_photos,
-    }
 
 
 @router.get("/api/albums/")
 async def get_all_albums(
     user_id: int = None,
     include_website: bool = False,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     # website-management albums live under /website, not the client Albums list.
     # the /website CMS pages pass include_website=true to list them for linking.
     filters = [] if include_website else [Album.is_website.isnot(True)]
+    q = select(Album).where(*filters)
     if user_id:
-        albums = (
-            session.query(Album)
-            .join(UserAlbumPermission, Album.id == UserAlbumPermission.album_id)
-            .filter(UserAlbumPermission.user_id == user_id, *filters)
-            .all()
-        )
-    else:
-        albums = session.query(Album).filter(*filters).all()
+        q = q.join(
+            UserAlbumPermission, Album.id == UserAlbumPermission.album_id
+        ).where(UserAlbumPermission.user_id == user_id)
+    albums = (await session.scalars(q)).all()
+
+    covers = await _album_covers(session, albums)
+    return [
+        {
+            "album_id": album.id,
+            "album_name": album.name,
+            "slug": album.slug,
+            "image_count": album.image_count,
+            "shared": album.shared,
+            "upload": album.upload,
+            "album_photos": covers[album.id],
+        }
+        for album in albums
+    ]
 
-    all_albums = []
-    for album in albums:
-        file_metadata = (
-            session.query(FileMetadata).filter_by(album_id=album.id).limit(4).all()
-        )
-        album_photos = create_album_photos_json(album.slug, file_metadata)
 
-        all_albums.append(
-            {
-                "album_id": album.id,
-                "album_name": album.name,
-                "slug": album.slug,
-                "image_count": album.image_count,
-                "shared": album.shared,
-                "upload": album.upload,
-                "album_photos": album_photos,
-            }
-        )
+def _encode_cursor(captured_at, photo_id):
+    raw = f"{captured_at.isoformat()}|{photo_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
 
-    return all_albums
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        at, photo_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(at), int(photo_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @router.get("/api/photos/")
 async def get_all_photos(
     user_id: int = None,
     orientation: str = None,
-    session: Session = Depends(get_session),
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = None,
+    fields: str = Depends(photo_fields),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    not_website = Album.is_website.isnot(True)
+    """Every photo across the (user's) albums, newest capture first — one
+    indexed query ordered by (captured_at, id). Pass `limit` to page: the
+    next page's `cursor` comes back in the X-Next-Cursor header (absent on
+    the last page). The body stays a plain list for existing clients;
+    `fields` picks the photo projection."""
+    q = (
+        select(*photo_columns(fields), FileMetadata.captured_at, Album.slug)
+        .join(Album, Album.id == FileMetadata.album_id)
+        .where(Album.is_website.isnot(True))
+    )
     if user_id:
-        albums = (
-            session.query(Album)
-            .join(UserAlbumPermission, Album.id == UserAlbumPermission.album_id)
-            .filter(UserAlbumPermission.user_id == user_id, not_website)
-            .all()
+        q = q.join(
+            UserAlbumPermission, Album.id == UserAlbumPermission.album_id
+        ).where(UserAlbumPermission.user_id == user_id)
+    if orientation:
+        q = q.where(FileMetadata.orientation == orientation)
+    if cursor:
+        # keyset: strictly after the last row of the previous page
+        q = q.where(
+            tuple_(FileMetadata.captured_at, FileMetadata.id)
+            < tuple_(*_decode_cursor(cursor))
         )
-    else:
-        albums = session.query(Album).filter(not_website).all()
+    q = q.order_by(FileMetadata.captured_at.desc(), FileMetadata.id.desc())
+    if limit:
+        q = q.limit(limit + 1)
+
+    rows = (await session.execute(q)).all()
+    headers = {}
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = _encode_cursor(last.captured_at, last.id)
+    return FastJSONResponse(
+        [build_photo_json(row, row.slug, fields) for row in rows], headers=headers
+    )
 
-    all_photos = []
-    for album in albums:
-        photos_query = session.query(FileMetadata).filter_by(album_id=album.id)
-        if orientation:
-            photos_query = photos_query.filter_by(orientation=orientation)
-        album_photos = create_album_photos_json(album.slug, photos_query.all())
-        all_photos.extend(album_photos)
 
-    # chronological across every album, newest first
-    all_photos.sort(key=capture_time, reverse=True)
-    return all_photos
+@router.get("/api/photo/{photo_id}/exif")
+async def get_photo_exif(
+    photo_id: int,
+    secret: str = None,
+    current_user=Depends(get_optional_user),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """One photo's EXIF, for the info panel — grid and lightbox payloads
+    leave it out. EXIF can carry GPS, so this is gated like the album it's
+    in: public albums are open, private ones need the share `secret`, an
+    admin, or a user granted the album."""
+    row = (
+        await session.execute(
+            select(FileMetadata.exif_data, Album.id, Album.public, Album.secret)
+            .join(Album, Album.id == FileMetadata.album_id)
+            .where(FileMetadata.id == photo_id)
+        )
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    allowed = bool(row.public) or (secret and secret == row.secret)
+    if not allowed and current_user:
+        access = await user_access_async(session, current_user.user_name)
+        allowed = access and (
+            access["role"] == "admin" or row.id in access["albums"]
+        )
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Not your album")
+    return FastJSONResponse({"id": photo_id, "exif_data": row.exif_data})
 
 
 @router.get("/api/album/{album_slug}/view")
 async def view_shared_album(
+    request: Request,
     album_slug: str,
     secret: str = None,
-    session: Session = Depends(get_session),
+    fields: str = Depends(photo_fields),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """Public share view. A private album requires the matching secret (the
     one baked into the share link); a public album opens for anyone. Returns
-    only gallery data — never permissions or client emails."""
-    album = session.query(Album).filter_by(slug=album_slug).first()
-    if not album:
-        raise HTTPException(status_code=404, detail="Gallery not found")
+    only gallery data — never permissions or client emails. Served from the
+    gallery cache once built, one entry per `fields` projection."""
+    key = ("view", album_slug, fields)
+    entry = gallery_cache.get(key)
+    if entry is None:
+        gen = gallery_cache.generation()
+        album = await session.scalar(select(Album).filter_by(slug=album_slug))
+        if not album:
+            raise HTTPException(status_code=404, detail="Gallery not found")
+        photos = (
+            await session.execute(
+                select(*photo_columns(fields))
+                .where(FileMetadata.album_id == album.id)
+                .order_by(FileMetadata.captured_at, FileMetadata.id)
+            )
+        ).all()
+        payload = {
+            "album_id": album.id,
+            "album_name": album.name,
+            "slug": album.slug,
+            "image_count": album.image_count,
+            "public": bool(album.public),
+            "album_photos": create_album_photos_json(album.slug, photos, fields),
+        }
+        entry = gallery_cache.put(
+            key,
+            payload,
+            [gallery_cache.album_tag(album_slug)],
+            gen,
+            public=bool(album.public),
+            secret=album.secret,
+        )
 
-    if not album.public:
-        if not secret or secret != album.secret:
+    if not entry["public"]:
+        if not secret or secret != entry["secret"]:
             raise HTTPException(
                 status_code=403, detail="This gallery is private — open it from the share link."
             )
 
-    photos = session.query(FileMetadata).filter_by(album_id=album.id).all()
-    return {
-        "album_id": album.id,
-        "album_name": album.name,
-        "slug": album.slug,
-        "image_count": album.image_count,
-        "public": bool(album.public),
-        "album_photos": create_album_photos_json(album.slug, photos),
-    }
+    return gallery_cache.respond(request, entry)
 
 
 class VisibilityBody(BaseModel):
@@ -197,6 +347,7 @@ async def set_album_visibility(
         raise HTTPException(status_code=404, detail="Album not found")
     album.public = body.public
     session.commit()
+    gallery_cache.invalidate(gallery_cache.album_tag(album_slug))
     return {"slug": album_slug, "public": bool(album.public)}
 
 
@@ -214,28 +365,13 @@ async def download_original(
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
 
-    u = session.query(User).filter_by(user_name=current_user.user_name).first()
-    if not u:
+    access = user_access(session, current_user.user_name)
+    if not access:
         raise HTTPException(status_code=401, detail="Unknown user")
-    if u.role != "admin":
-        allowed = (
-            session.query(UserAlbumPermission)
-            .filter_by(user_id=u.id, album_id=album.id)
-            .first()
-        )
-        if not allowed:
-            raise HTTPException(status_code=403, detail="Not your album")
-
-    url = s3_client.generate_presigned_url(
-        "get_object",
-        Params={
-            "Bucket": AWS_BUCKET,
-            "Key": f"{album_slug}/{filename}",
-            "ResponseContentDisposition": f'attachment; filename="{filename}"',
-        },
-        ExpiresIn=3600,
-    )
-    return {"url": url}
+    if access["role"] != "admin" and album.id not in access["albums"]:
+        raise HTTPException(status_code=403, detail="Not your album")
+
+    return {"url": presigned_get(f"{album_slug}/{filename}", 3600, filename=filename)}
 
 
 @router.delete("/api/album/delete/{album_slug}/")
@@ -295,6 +431,10 @@ async def delete_album(
         # DB is the source of truth — commit it before the slow S3 cleanup so a
         # storage hiccup can't leave the album half-deleted / un-deletable
         session.commit()
+        if orphaned:
+            matcher.invalidate()
+        gallery_cache.invalidate(gallery_cache.album_tag(album_slug))
+        clear_user_access()
 
         # best-effort S3 cleanup, batched (delete_objects takes up to 1000 keys)
         keys = [{"Key": f"{album_slug}/{fn}"} for fn in filenames]
@@ -354,6 +494,9 @@ async def update_album(
             }
         )
         session.commit()
+        gallery_cache.invalidate(
+            gallery_cache.album_tag(old_slug), gallery_cache.album_tag(new_slug)
+        )
 
         if old_slug != new_slug:
             try:
@@ -387,6 +530,7 @@ async def update_album(
                         user_id=user_id, album_id=album.id
                     ).delete()
                     session.commit()
+                    invalidate_user_access(user_id)
 
         return {"message": "Album updated successfully."}
     except HTTPException:
@@ -398,28 +542,20 @@ async def update_album(
 
 
 @router.get("/api/shared-albums/")
-async def get_shared_albums(session: Session = Depends(get_session)):
-    albums = session.query(Album).filter_by(shared=True).all()
-
-    all_albums = []
-    for album in albums:
-        file_metadata = (
-            session.query(FileMetadata).filter_by(album_id=album.id).limit(4).all()
-        )
-        album_photos = create_album_photos_json(album.slug, file_metadata)
-
-        all_albums.append(
-            {
-                "album_name": album.name,
-                "slug": album.slug,
-                "image_count": album.image_count,
-                "shared": album.shared,
-                "upload": album.upload,
-                "album_photos": album_photos,
-            }
-        )
-
-    return all_albums
+async def get_shared_albums(session: AsyncSession = Depends(get_async_session)):
+    albums = (await session.scalars(select(Album).filter_by(shared=True))).all()
+    covers = await _album_covers(session, albums)
+    return [
+        {
+            "album_name": album.name,
+            "slug": album.slug,
+            "image_count": album.image_count,
+            "shared": album.shared,
+            "upload": album.upload,
+            "album_photos": covers[album.id],
+        }
+        for album in albums
+    ]
 
 
 @router.delete("/api/photo/delete/")
@@ -453,5 +589,6 @@ async def delete_photo(
 
     album.image_count = max(0, album.image_count - 1)
     session.commit()
+    gallery_cache.invalidate(gallery_cache.album_tag(slug))
 
     return {"message": "Photo deleted successfully."}
@@ -1,48 +1,79 @@
 import os
 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, Request, UploadFile, File
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from db.base import get_session
+from db.base import get_async_session, get_session
 from db.models import Category, AlbumCategory, Album, FileMetadata, CategoryPhoto
-from utils.utils import create_album_photos_json, build_photo_json, capture_time
-from dependencies import get_current_user, require_admin
+from services import gallery_cache
+from services.photo_ingest import ingest_images
+from utils.utils import create_album_photos_json, build_photo_json, photo_columns
+from dependencies import get_current_user, require_admin, photo_fields
 
 router = APIRouter()
 
 
-def _curated_photos(session, category_id, orientation=None):
-    """A category's curated photos: ordered, deduped, each URL built from the
-    album it actually lives in. Returns None when nothing's curated yet so the
-    caller can fall back to the old one-album-per-category behaviour."""
+async def _curated_photos(session, category_id, orientation=None, fields="full"):
+    """A category's curated photos: newest work first, deduped, each URL built
+    from the album it actually lives in. Returns (photos, album slugs they
+    come from); photos is None when nothing's curated yet so the caller can
+    fall back to the old one-album-per-category behaviour."""
     q = (
-        session.query(FileMetadata, Album.slug)
+        select(*photo_columns(fields), Album.slug)
         .join(CategoryPhoto, CategoryPhoto.photo_id == FileMetadata.id)
         .join(Album, Album.id == FileMetadata.album_id)
-        .filter(CategoryPhoto.category_id == category_id)
-        .order_by(CategoryPhoto.sort_order, CategoryPhoto.id)
+        .where(CategoryPhoto.category_id == category_id)
+        .order_by(
+            FileMetadata.captured_at.desc(),
+            CategoryPhoto.sort_order,
+            CategoryPhoto.id,
+        )
     )
     if orientation:
-        q = q.filter(FileMetadata.orientation == orientation)
-    rows = q.all()
+        q = q.where(FileMetadata.orientation == orientation)
+    rows = (await session.execute(q)).all()
     if not rows:
-        return None
-    seen, out = set(), []
-    for meta, slug in rows:
-        if meta.id in seen:
+        return None, set()
+    seen, out, slugs = set(), [], set()
+    for row in rows:
+        if row.id in seen:
             continue
-        seen.add(meta.id)
-        out.append(build_photo_json(meta, slug))
-    return out
+        seen.add(row.id)
+        slugs.add(row.slug)
+        out.append(build_photo_json(row, row.slug, fields))
+    return out, slugs
+
+
+def _changed(category_id):
+    # drop the category's cached gallery and the all-categories listing
+    gallery_cache.invalidate(
+        gallery_cache.category_tag(category_id), gallery_cache.CATEGORIES
+    )
+
+
+async def _album_photos(session, album, orientation=None, fields="full"):
+    # website gallery reads newest work first; served by the
+    # (album_id, captured_at, id) index
+    q = select(*photo_columns(fields)).where(FileMetadata.album_id == album.id)
+    if orientation:
+        q = q.where(FileMetadata.orientation == orientation)
+    rows = (
+        await session.execute(
+            q.order_by(FileMetadata.captured_at.desc(), FileMetadata.id.desc())
+        )
+    ).all()
+    return create_album_photos_json(album.slug, rows, fields)
 
 
 # route for getting all categories
 @router.get("/api/categories")
 async def get_categories(
-    current_user=Depends(get_current_user), session: Session = Depends(get_session)
+    current_user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    categories = session.query(Category).all()
+    categories = (await session.scalars(select(Category))).all()
     return [
         {"id": category.id, "name": category.name, "slug": category.slug}
         for category in categories
@@ -58,6 +89,8 @@ async def create_category(
 ):
     slug = name.lower().replace(" ", "-")
     session.add(Category(name=name, slug=slug))
+    session.commit()
+    gallery_cache.invalidate(gallery_cache.CATEGORIES)
     return {"message": "Category created successfully"}
 
 
@@ -70,6 +103,8 @@ async def delete_category(
 ):
     session.query(AlbumCategory).filter_by(category_id=category_id).delete()
     session.query(Category).filter_by(id=category_id).delete()
+    session.commit()
+    _changed(category_id)
     return {"message": "Category deleted successfully"}
 
 
@@ -82,6 +117,8 @@ async def link_album_to_category(
     session: Session = Depends(get_session),
 ):
     session.add(AlbumCategory(album_id=album_id, category_id=category_id))
+    session.commit()
+    _changed(category_id)
     return {"message": "Album linked to category successfully"}
 
 
@@ -96,38 +133,54 @@ async def unlink_album_from_category(
     session.query(AlbumCategory).filter_by(
         album_id=album_id, category_id=category_id
     ).delete()
+    session.commit()
+    _changed(category_id)
     return {"message": "Album unlinked from category successfully"}
 
 
 # route for the category albums get the one album linked to it
 @router.get("/api/category-albums/{category_id}")
 async def get_album_by_category(
+    request: Request,
     category_id: int,
+    fields: str = Depends(photo_fields),
     current_user=Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    album = (
-        session.query(Album)
+    key = ("category", category_id, fields)
+    entry = gallery_cache.get(key)
+    if entry is None:
+        gen = gallery_cache.generation()
+        payload, tags = await _category_album(session, category_id, fields)
+        entry = gallery_cache.put(key, payload, tags, gen)
+    return gallery_cache.respond(request, entry)
+
+
+def _linked_album(category_id):
+    # the one album a category falls back to when nothing's curated
+    return (
+        select(Album)
         .join(AlbumCategory, Album.id == AlbumCategory.album_id)
-        .filter(AlbumCategory.category_id == category_id)
-        .first()
+        .where(AlbumCategory.category_id == category_id)
+        .limit(1)
     )
 
+
+async def _category_album(session, category_id, fields):
+    album = await session.scalar(_linked_album(category_id))
+
     # curated selection wins; fall back to the whole linked album
-    album_photos = _curated_photos(session, category_id)
+    album_photos, slugs = await _curated_photos(session, category_id, fields=fields)
     if album_photos is None:
         if not album:
             raise HTTPException(status_code=404, detail="Album not found for this category")
-        album_photos = create_album_photos_json(
-            album.slug, session.query(FileMetadata).filter_by(album_id=album.id).all()
-        )
-
-    # website gallery reads newest work first
-    album_photos.sort(key=capture_time, reverse=True)
+        album_photos = await _album_photos(session, album, fields=fields)
+    tags = {gallery_cache.category_tag(category_id)}
+    tags.update(gallery_cache.album_tag(slug) for slug in slugs)
 
     if not album:
         # curated-only category (no backing album) — name it from the category
-        cat = session.get(Category, category_id)
+        cat = await session.get(Category, category_id)
         return {
             "id": category_id,
             "name": cat.name if cat else "",
@@ -139,8 +192,9 @@ async def get_album_by_category(
             "upload": False,
             "secret": None,
             "album_photos": album_photos,
-        }
+        }, tags
 
+    tags.add(gallery_cache.album_tag(album.slug))
     return {
         "id": album.id,
         "name": album.name,
@@ -152,35 +206,40 @@ async def get_album_by_category(
         "upload": album.upload,
         "secret": album.secret,
         "album_photos": album_photos,
-    }
+    }, tags
 
 
 # route for getting all albums linked each category
 @router.get("/api/category-albums")
 async def get_albums_by_category(
-    orientation: str = None, session: Session = Depends(get_session)
+    request: Request,
+    orientation: str = None,
+    fields: str = Depends(photo_fields),
+    session: AsyncSession = Depends(get_async_session),
 ):
+    key = ("categories", orientation, fields)
+    entry = gallery_cache.get(key)
+    if entry is not None:
+        return gallery_cache.respond(request, entry)
+
+    gen = gallery_cache.generation()
+    tags = {gallery_cache.CATEGORIES}
     out = []
-    for category in session.query(Category).order_by(Category.id).all():
-        album = (
-            session.query(Album)
-            .join(AlbumCategory, Album.id == AlbumCategory.album_id)
-            .filter(AlbumCategory.category_id == category.id)
-            .first()
-        )
+    categories = (await session.scalars(select(Category).order_by(Category.id))).all()
+    for category in categories:
+        album = await session.scalar(_linked_album(category.id))
 
         # curated selection wins; fall back to the whole linked album
-        album_photos = _curated_photos(session, category.id, orientation)
+        album_photos, slugs = await _curated_photos(
+            session, category.id, orientation, fields
+        )
         if album_photos is None:
             if not album:
                 continue
-            photos_query = session.query(FileMetadata).filter_by(album_id=album.id)
-            if orientation:
-                photos_query = photos_query.filter_by(orientation=orientation)
-            album_photos = create_album_photos_json(album.slug, photos_query.all())
-
-        # website gallery reads newest work first
-        album_photos.sort(key=capture_time, reverse=True)
+            album_photos = await _album_photos(session, album, orientation, fields)
+        tags.update(gallery_cache.album_tag(slug) for slug in slugs)
+        if album:
+            tags.add(gallery_cache.album_tag(album.slug))
 
         album_details = {
             "id": album.id if album else category.id,
@@ -201,7 +260,8 @@ async def get_albums_by_category(
             "album": album_details,
         })
 
-    return out
+    entry = gallery_cache.put(key, out, tags, gen)
+    return gallery_cache.respond(request, entry)
 
 
 # ---- admin: curate a category's photos (references, no re-upload) ----
@@ -218,10 +278,10 @@ def list_category_photos(
         .join(CategoryPhoto, CategoryPhoto.photo_id == FileMetadata.id)
         .join(Album, Album.id == FileMetadata.album_id)
         .filter(CategoryPhoto.category_id == category_id)
+        # newest work first, matching the public gallery
+        .order_by(FileMetadata.captured_at.desc(), FileMetadata.id.desc())
         .all()
     )
-    # newest work first, matching the public gallery
-    rows.sort(key=lambda r: capture_time(r[0]), reverse=True)
     return [
         {
             "photo_id": meta.id,
@@ -264,6 +324,7 @@ def add_category_photos(
         existing.add(pid)
         session.add(CategoryPhoto(category_id=category_id, photo_id=pid, sort_order=base))
     session.commit()
+    _changed(category_id)
     return {"added": added}
 
 
@@ -278,6 +339,7 @@ def remove_category_photo(
         category_id=category_id, photo_id=photo_id
     ).delete()
     session.commit()
+    _changed(category_id)
     return {"message": "Removed"}
 
 
@@ -308,14 +370,12 @@ async def upload_category_photo(
     ctype = file.content_type or "image/jpeg"
 
     # full pipeline (S3 + metadata + blur), no face detection for website art
-    from routers.files.files_router import _store_one_file
-
-    _store_one_file(content, filename, ctype, album, session, False, [], [])
-    meta = (
-        session.query(FileMetadata)
-        .filter_by(album_id=album.id, filename=filename)
-        .first()
-    )
+    stored = await ingest_images([(filename, ctype, lambda: content)], album)
+    # nothing stored means the S3 upload or the image analysis failed — a
+    # same-named row from an earlier upload must not pass for this one
+    if not stored:
+        raise HTTPException(status_code=502, detail="Upload failed")
+    meta = session.get(FileMetadata, stored[0][1], populate_existing=True)
     if not meta:
         raise HTTPException(status_code=500, detail="Upload failed")
 
@@ -329,6 +389,8 @@ async def upload_category_photo(
             CategoryPhoto(category_id=category_id, photo_id=meta.id, sort_order=base + 1)
         )
     session.commit()
+    gallery_cache.invalidate(gallery_cache.album_tag(album.slug))
+    _changed(category_id)
     return {
         "photo_id": meta.id,
         "album_id": meta.album_id,
@@ -354,4 +416,5 @@ def reorder_category_photos(
         if cp.photo_id in order:
             cp.sort_order = order[cp.photo_id]
     session.commit()
+    _changed(category_id)
     return {"message": "Reordered"}
@@ -21,6 +21,7 @@ from db.base import get_session
 from db.models import Album, ClientFile, User as UserModel
 from dependencies import get_current_user, require_admin
 from services.aws_service import s3_client
+from services.media_urls import presigned_get
 
 router = APIRouter()
 AWS_BUCKET = settings.AWS_BUCKET
@@ -49,16 +50,8 @@ def _file_json(cf: ClientFile, session: Session, with_url: bool = False) -> dict
         "created_at": cf.created_at.isoformat() if cf.created_at else None,
     }
     if with_url:
-        data["download_url"] = s3_client.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": AWS_BUCKET,
-                "Key": cf.s3_key,
-                # force a download with the original filename
-                "ResponseContentDisposition": f'attachment; filename="{cf.filename}"',
-            },
-            ExpiresIn=3600,
-        )
+        # force a download with the original filename
+        data["download_url"] = presigned_get(cf.s3_key, 3600, filename=cf.filename)
     return data
 
 
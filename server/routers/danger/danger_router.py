@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends
+from services import gallery_cache
 from services.danger_delete import delete_all_resources
 from db.migrate import run_migrations
 from db.seed import seed_root_user
-from dependencies import get_current_user
+from dependencies import clear_user_access, get_current_user
 
 router = APIRouter()
 
@@ -12,4 +13,6 @@ async def delete_files(current_user=Depends(get_current_user)):
     delete_all_resources()
     run_migrations()
     seed_root_user()
+    gallery_cache.clear()
+    clear_user_access()
     return {"message": "All files in the bucket have been deleted."}
@@ -1,68 +1,97 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import func, literal_column, select, text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from config import settings
-from db.base import get_session, session_scope
+from db.base import get_async_session, get_session, session_scope
 from db.models import (
     FaceData,
     FaceEmbedding,
     PhotoFaceLink,
     FileMetadata,
     Album,
-    User,
-    UserAlbumPermission,
 )
 from utils.utils import create_album_photos_json
 from utils.face_recog import (
-    detect_and_store_faces,
     assign_pending_faces,
     recluster_faces,
+    recluster_photos,
     set_person_cover,
     MATCH_DIST,
     SUGGEST_DIST,
 )
-from dependencies import get_current_user, require_admin
+from dependencies import (
+    get_current_user,
+    require_admin,
+    photo_fields,
+    user_access_async,
+)
 from services.aws_service import s3_client
+from services.media_urls import cdn_url, detail_url, grid_url
 from services import upload_jobs
+from services.face_indexing import index_faces
+from utils.face_matcher import matcher
+from utils.fast_json import FastJSONResponse
 
 router = APIRouter()
 AWS_BUCKET = settings.AWS_BUCKET
-AWS_CLOUDFRONT_URL = settings.AWS_CLOUDFRONT_URL
+
+# merge suggestions: embeddings sampled from the person, neighbours fetched
+# per sample, people shown
+SUGGEST_PROBES = 8
+SUGGEST_KNN = 30
+SUGGEST_LIMIT = 12
 
 
-def _accessible_album_ids(current_user, session):
+async def _accessible_album_ids(current_user, session):
     """Which albums this caller may see. None = admin (everything). For a client
     it's only the albums they've been granted. Face clustering is global (the
     same person is recognised across albums), but a client must never see a
     photo from an album they don't own — even one their own face appears in."""
-    u = session.query(User).filter_by(user_name=current_user.user_name).first()
-    if u and u.role == "admin":
+    access = await user_access_async(session, current_user.user_name)
+    if access and access["role"] == "admin":
         return None
-    if not u:
+    if not access:
         return set()
-    return {
-        r[0]
-        for r in session.query(UserAlbumPermission.album_id)
-        .filter_by(user_id=u.id)
-        .all()
-    }
+    return set(access["albums"])
+
 
+def _clear_album_faces(album_id: int):
+    """Drop an album's face links + embeddings; returns its (filename, id,
+    content_type) rows for re-detection, and the people those faces belonged
+    to (they need re-clustering even if none of them come back)."""
+    with session_scope() as session:
+        people = {
+            r[0]
+            for r in session.query(FaceEmbedding.face_id)
+            .filter(
+                FaceEmbedding.album_id == album_id,
+                FaceEmbedding.face_id.isnot(None),
+            )
+            .distinct()
+        }
+        session.query(PhotoFaceLink).filter_by(album_id=album_id).delete()
+        session.query(FaceEmbedding).filter_by(album_id=album_id).delete()
+        photos = (
+            session.query(FileMetadata.filename, FileMetadata.id, FileMetadata.content_type)
+            .filter_by(album_id=album_id)
+            .all()
+        )
+    matcher.invalidate()
+    return photos, people
 
-def _resync_album_faces(album_id: int, album_slug: str):
+
+async def _resync_album_faces(album_id: int, album_slug: str):
     """Re-run face detection over every photo in an album. Runs in a
     background task so the request returns immediately. Clears the album's
     existing face links first so re-runs don't leave stale data. Reports
     progress through the same job registry the upload flow uses."""
     try:
-        with session_scope() as session:
-            session.query(PhotoFaceLink).filter_by(album_id=album_id).delete()
-            session.query(FaceEmbedding).filter_by(album_id=album_id).delete()
-            photos = (
-                session.query(FileMetadata.filename, FileMetadata.id, FileMetadata.content_type)
-                .filter_by(album_id=album_id)
-                .all()
-            )
+        photos, people = await asyncio.to_thread(_clear_album_faces, album_id)
 
         images = [p for p in photos if not (p[2] or "").startswith("video/")]
         total = len(images)
@@ -70,20 +99,18 @@ def _resync_album_faces(album_id: int, album_slug: str):
             album_slug, face_detection=True, image_count=total, kind="resync"
         )
 
-        done = 0
-        for filename, meta_id, content_type in images:
-            s3_key = f"{album_slug}/{filename}"
-            try:
-                detect_and_store_faces(s3_key, meta_id, album_id, AWS_BUCKET)
-                done += 1
-            except Exception as e:
-                print(f"resync: face detection failed for {s3_key}: {e}")
-            upload_jobs.update_job(album_slug, phase="faces", current=done, total=total)
-
-        # authoritative global re-cluster (Chinese Whispers) — order-independent,
-        # chaining-resistant, repicks key chips and preserves names
+        async def _progress(done, n):
+            upload_jobs.update_job(album_slug, phase="faces", current=done, total=n)
+
+        targets = [(f"{album_slug}/{filename}", meta_id) for filename, meta_id, _ in images]
+        done = await index_faces(targets, album_id, AWS_BUCKET, _progress)
+
+        # re-cluster just the people this album touches (Chinese Whispers) —
+        # repicks their key chips and preserves names; everyone else is kept
         upload_jobs.update_job(album_slug, phase="clustering")
-        recluster_faces()
+        await asyncio.to_thread(
+            recluster_photos, [meta_id for _, meta_id in targets], people
+        )
         upload_jobs.finish_job(album_slug)
         print(f"resync: album {album_slug!r} done — processed {done}/{total} photos")
     except Exception as e:
@@ -93,14 +120,20 @@ def _resync_album_faces(album_id: int, album_slug: str):
 
 @router.get("/api/face")
 async def get_faces(
-    current_user=Depends(get_current_user), session: Session = Depends(get_session)
+    current_user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    allowed = _accessible_album_ids(current_user, session)
-    q = session.query(PhotoFaceLink)
+    allowed = await _accessible_album_ids(current_user, session)
+    q = select(
+        PhotoFaceLink.id,
+        PhotoFaceLink.photo_id,
+        PhotoFaceLink.face_id,
+        PhotoFaceLink.album_id,
+    )
     if allowed is not None:
         if not allowed:
             return []
-        q = q.filter(PhotoFaceLink.album_id.in_(allowed))
+        q = q.where(PhotoFaceLink.album_id.in_(list(allowed)))
     return [
         {
             "id": face.id,
@@ -108,7 +141,7 @@ async def get_faces(
             "face_id": face.face_id,
             "album_id": face.album_id,
         }
-        for face in q.all()
+        for face in await session.execute(q)
     ]
 
 
@@ -116,15 +149,15 @@ async def get_faces(
 async def get_face_photo(
     face_id: str,
     current_user=Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    allowed = _accessible_album_ids(current_user, session)
-    q = session.query(PhotoFaceLink.photo_id).filter_by(face_id=face_id)
+    allowed = await _accessible_album_ids(current_user, session)
+    q = select(PhotoFaceLink.photo_id).filter_by(face_id=face_id)
     if allowed is not None:
         if not allowed:
             raise HTTPException(status_code=404, detail="Photo not found for this face")
-        q = q.filter(PhotoFaceLink.album_id.in_(allowed))
-    link = q.first()
+        q = q.where(PhotoFaceLink.album_id.in_(list(allowed)))
+    link = (await session.execute(q.limit(1))).first()
 
     if not link:
         raise HTTPException(status_code=404, detail="Photo not found for this face")
@@ -134,53 +167,94 @@ async def get_face_photo(
 
 @router.get("/api/faces")
 async def get_faces(
-    current_user=Depends(get_current_user), session: Session = Depends(get_session)
+    limit: int = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    limit_links: int = Query(None, ge=0),
+    current_user=Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    allowed = _accessible_album_ids(current_user, session)
+    """Every person visible to the caller with their photo links, grouped in
+    Postgres (json_agg per face_id) rather than matched up in Python.
+    `limit`/`offset` page through people — the page of face_data rows is
+    picked first, so only its links are aggregated; `limit_links` caps the
+    links returned per person (0 for none) — `link_count` always has the
+    total."""
+    allowed = await _accessible_album_ids(current_user, session)
+    if allowed is not None and not allowed:
+        return []
 
-    link_q = session.query(PhotoFaceLink)
-    if allowed is not None:
-        if not allowed:
-            return []
-        link_q = link_q.filter(PhotoFaceLink.album_id.in_(allowed))
-    links = link_q.all()
-
-    # only surface people who actually appear in an album this caller can see
-    visible_face_ids = {link.face_id for link in links}
-    faces = (
-        session.query(FaceData)
-        .filter(FaceData.external_id.in_(visible_face_ids))
-        .all()
-        if visible_face_ids
-        else []
+    def visible(q):
+        # only people who actually appear in an album this caller can see
+        if allowed is not None:
+            q = q.where(PhotoFaceLink.album_id.in_(list(allowed)))
+        return q
+
+    has_link = visible(
+        select(PhotoFaceLink.id).where(PhotoFaceLink.face_id == FaceData.external_id)
+    ).exists()
+    page = (
+        select(FaceData.id, FaceData.name, FaceData.external_id)
+        .where(has_link)
+        .order_by(FaceData.id)
+        .offset(offset)
+    )
+    if limit:
+        page = page.limit(limit)
+    page = page.cte("page")
+
+    links = visible(
+        select(
+            PhotoFaceLink.face_id,
+            PhotoFaceLink.photo_id,
+            PhotoFaceLink.album_id,
+            PhotoFaceLink.id,
+            func.row_number()
+            .over(partition_by=PhotoFaceLink.face_id, order_by=PhotoFaceLink.id)
+            .label("rn"),
+        ).join(page, page.c.external_id == PhotoFaceLink.face_id)
+    ).subquery()
+
+    photo_links = func.json_agg(
+        aggregate_order_by(
+            func.json_build_object(
+                literal_column("'photo_id'"),
+                links.c.photo_id,
+                literal_column("'album_id'"),
+                links.c.album_id,
+            ),
+            links.c.id,
+        )
+    )
+    if limit_links is not None:
+        photo_links = photo_links.filter(links.c.rn <= limit_links)
+    grouped = (
+        select(
+            links.c.face_id,
+            func.count().label("link_count"),
+            func.coalesce(photo_links, text("'[]'::json")).label("photo_links"),
+        )
+        .group_by(links.c.face_id)
+        .subquery()
+    )
+    q = (
+        select(page, grouped.c.link_count, grouped.c.photo_links)
+        .join(grouped, grouped.c.face_id == page.c.external_id)
+        .order_by(page.c.id)
     )
 
-    face_photo_links = [
-        {
-            "face_id": link.face_id,
-            "photo_id": link.photo_id,
-            "album_id": link.album_id,
-        }
-        for link in links
-    ]
-
-    return [
-        {
-            "id": face.id,
-            "name": face.name,
-            "external_id": face.external_id,
-            "image_url": f"https://{AWS_CLOUDFRONT_URL}/faces/{face.external_id}.jpg",
-            "photo_links": [
-                {
-                    "photo_id": fpl["photo_id"],
-                    "album_id": fpl["album_id"],
-                }
-                for fpl in face_photo_links
-                if fpl["face_id"] == face.external_id
-            ],
-        }
-        for face in faces
-    ]
+    return FastJSONResponse(
+        [
+            {
+                "id": row.id,
+                "name": row.name,
+                "external_id": row.external_id,
+                "image_url": cdn_url(f"faces/{row.external_id}.jpg"),
+                "link_count": row.link_count,
+                "photo_links": row.photo_links,
+            }
+            for row in await session.execute(q)
+        ]
+    )
 
 
 @router.get("/api/face/{face_id}/suggestions")
@@ -192,51 +266,58 @@ def face_suggestions(
     """Other people whose embeddings sit just past the auto-merge line from this
     one — likely the same person split in two. Cosine band between the match and
     suggest thresholds. The admin reviews + merges manually."""
-    targets = (
-        session.query(FaceEmbedding.embedding)
-        .filter(FaceEmbedding.face_id == face_id)
-        .limit(8)
-        .all()
-    )
-    if not targets:
-        return []
-
-    # min distance to each OTHER person across our sampled target embeddings
-    best: dict[str, float] = {}
-    for (emb,) in targets:
-        rows = (
-            session.query(
-                FaceEmbedding.face_id,
-                FaceEmbedding.embedding.cosine_distance(emb).label("dist"),
+    # every sampled embedding probes the HNSW index in one LATERAL query;
+    # each other person keeps their closest hit, and their name + photo count
+    # come back on the same row
+    rows = session.execute(
+        text(
+            """
+            WITH probe AS (
+                SELECT embedding FROM face_embedding
+                WHERE face_id = :face_id
+                ORDER BY id
+                LIMIT :probes
+            ), near AS (
+                SELECT nn.face_id, min(nn.dist) AS dist
+                FROM probe p
+                CROSS JOIN LATERAL (
+                    SELECT b.face_id, b.embedding <=> p.embedding AS dist
+                    FROM face_embedding b
+                    WHERE b.face_id IS NOT NULL AND b.face_id <> :face_id
+                    ORDER BY b.embedding <=> p.embedding
+                    LIMIT :k
+                ) nn
+                WHERE nn.dist <= :max_dist
+                GROUP BY nn.face_id
             )
-            .filter(
-                FaceEmbedding.face_id.isnot(None),
-                FaceEmbedding.face_id != face_id,
-            )
-            .order_by("dist")
-            .limit(30)
-            .all()
-        )
-        for fid, dist in rows:
-            if dist is None or dist > SUGGEST_DIST:
-                continue
-            if fid not in best or dist < best[fid]:
-                best[fid] = dist
-
-    out = []
-    for fid, dist in sorted(best.items(), key=lambda kv: kv[1]):
-        fd = session.query(FaceData).filter_by(external_id=fid).first()
-        if not fd:
-            continue
-        cnt = session.query(PhotoFaceLink).filter_by(face_id=fid).count()
-        out.append({
-            "external_id": fid,
-            "name": fd.name,
-            "similarity": round((1 - dist) * 100, 1),
-            "count": cnt,
-            "image_url": f"https://{AWS_CLOUDFRONT_URL}/faces/{fid}.jpg",
-        })
-    return out[:12]
+            SELECT n.face_id, n.dist, f.name,
+                   (SELECT count(*) FROM photo_face_link l
+                    WHERE l.face_id = n.face_id) AS photo_count
+            FROM near n
+            JOIN face_data f ON f.external_id = n.face_id
+            ORDER BY n.dist
+            LIMIT :limit
+            """
+        ),
+        {
+            "face_id": face_id,
+            "probes": SUGGEST_PROBES,
+            "k": SUGGEST_KNN,
+            "max_dist": SUGGEST_DIST,
+            "limit": SUGGEST_LIMIT,
+        },
+    ).all()
+
+    return [
+        {
+            "external_id": row.face_id,
+            "name": row.name,
+            "similarity": round((1 - row.dist) * 100, 1),
+            "count": row.photo_count,
+            "image_url": cdn_url(f"faces/{row.face_id}.jpg"),
+        }
+        for row in rows
+    ]
 
 
 class MergeFacesBody(BaseModel):
@@ -297,6 +378,7 @@ def merge_faces(
         ).delete(synchronize_session=False)
 
     session.commit()
+    matcher.invalidate()
     return {"message": "Merged", "target": body.target_face_id}
 
 
@@ -330,7 +412,8 @@ async def recluster(
 ):
     """Re-run Chinese Whispers clustering over the stored embeddings — no
     re-detection, no GPU. Fast way to re-group everyone after a threshold
-    change. Runs in the background."""
+    change. Rebuilds every person in the library (uploads and resyncs only
+    recluster the people they touch). Runs in the background."""
     background.add_task(_recluster_task)
     return {"message": "Recluster started"}
 
@@ -360,113 +443,128 @@ async def resync_album_faces(
 async def get_album_faces(
     album_slug: str,
     current_user=Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """Distinct people detected in an album, each with a key face crop and the
     filenames of the photos they appear in (so the client can filter the grid)."""
-    album = session.query(Album).filter_by(slug=album_slug).first()
+    album = await session.scalar(select(Album).filter_by(slug=album_slug))
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
 
-    allowed = _accessible_album_ids(current_user, session)
+    allowed = await _accessible_album_ids(current_user, session)
     if allowed is not None and album.id not in allowed:
         raise HTTPException(status_code=403, detail="Not your album")
 
-    links = session.query(PhotoFaceLink).filter_by(album_id=album.id).all()
-
-    by_face: dict[str, list[str]] = {}
-    for link in links:
-        photo = session.get(FileMetadata, link.photo_id)
-        if not photo:
-            continue
-        by_face.setdefault(link.face_id, []).append(photo.filename)
-
-    faces = []
-    for face_id, filenames in by_face.items():
-        face = session.query(FaceData).filter_by(external_id=face_id).first()
-        # skip stale links whose person no longer exists — never show a phantom
-        # tile that would surface unrelated photos
-        if not face:
-            continue
-        faces.append(
-            {
-                "face_id": face_id,
-                "name": face.name,
-                # thumbor form so the client loader can resize the crop
-                "image_url": f"https://{AWS_CLOUDFRONT_URL}/fit-in/720x0/faces/{face_id}.jpg",
-                "count": len(filenames),
-                "filenames": filenames,
-            }
+    # one grouped join: each person in the album with their photos' filenames.
+    # The inner join to face_data skips stale links whose person no longer
+    # exists — never show a phantom tile that would surface unrelated photos
+    count = func.count(PhotoFaceLink.id)
+    rows = await session.execute(
+        select(
+            PhotoFaceLink.face_id,
+            FaceData.name,
+            count.label("photo_count"),
+            func.array_agg(
+                aggregate_order_by(FileMetadata.filename, PhotoFaceLink.id)
+            ).label("filenames"),
         )
+        .join(FileMetadata, FileMetadata.id == PhotoFaceLink.photo_id)
+        .join(FaceData, FaceData.external_id == PhotoFaceLink.face_id)
+        .where(PhotoFaceLink.album_id == album.id)
+        .group_by(PhotoFaceLink.face_id, FaceData.name)
+        # most-photographed people first
+        .order_by(count.desc(), PhotoFaceLink.face_id)
+    )
 
-    # most-photographed people first
-    faces.sort(key=lambda f: f["count"], reverse=True)
+    faces = [
+        {
+            "face_id": row.face_id,
+            "name": row.name,
+            # thumbor form so the client loader can resize the crop
+            "image_url": grid_url(f"faces/{row.face_id}.jpg"),
+            "count": row.photo_count,
+            "filenames": row.filenames,
+        }
+        for row in rows
+    ]
     return faces
 
 
 @router.get("/api/face/{face_id}")
 async def get_face(
     face_id: str,
+    fields: str = Depends(photo_fields),
     current_user=Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    face = session.query(FaceData).filter_by(external_id=face_id).first()
+    """A person and every photo of them the caller may see. The photos keep
+    this endpoint's older file_metadata shape rather than PHOTO_FIELDS, so
+    `fields` only decides whether exif_data is included: `full` has it,
+    `lightbox` and `grid` both leave it out and are otherwise identical."""
+    face = await session.scalar(select(FaceData).filter_by(external_id=face_id))
 
     if not face:
         raise HTTPException(status_code=404, detail="Face not found")
 
-    allowed = _accessible_album_ids(current_user, session)
-    link_q = session.query(PhotoFaceLink).filter_by(face_id=face.external_id)
+    allowed = await _accessible_album_ids(current_user, session)
+    # every linked photo + its album in one query, straight to row tuples
+    q = (
+        select(
+            FileMetadata.id,
+            FileMetadata.album_id,
+            FileMetadata.filename,
+            FileMetadata.content_type,
+            FileMetadata.size,
+            FileMetadata.upload_date,
+            FileMetadata.blur_data_url,
+            *((FileMetadata.exif_data,) if fields == "full" else ()),
+            Album.slug,
+        )
+        .select_from(PhotoFaceLink)
+        .join(FileMetadata, FileMetadata.id == PhotoFaceLink.photo_id)
+        .join(Album, Album.id == PhotoFaceLink.album_id)
+        .where(PhotoFaceLink.face_id == face.external_id)
+        .order_by(PhotoFaceLink.id)
+    )
     if allowed is not None:
         if not allowed:
             raise HTTPException(status_code=404, detail="Face not found")
-        link_q = link_q.filter(PhotoFaceLink.album_id.in_(allowed))
-    links = link_q.all()
+        q = q.where(PhotoFaceLink.album_id.in_(list(allowed)))
+    rows = (await session.execute(q)).all()
     # this person exists globally but appears in nothing the caller can see
-    if not links:
+    if not rows:
         raise HTTPException(status_code=404, detail="Face not found")
-    face_photo_links = [
-        {"photo_id": link.photo_id, "album_id": link.album_id} for link in links
-    ]
 
     face_photos = []
-    for fpl in face_photo_links:
-        photo = session.get(FileMetadata, fpl["photo_id"])
-        if not photo:
-            continue
-
-        album = session.get(Album, fpl["album_id"])
-        if not album:
-            continue
-
-        album_slug = album.slug
-
-        compressed_image_url = f"https://{AWS_CLOUDFRONT_URL}/fit-in/720x0/{album_slug}/{photo.filename}"
-        image_url = f"https://{AWS_CLOUDFRONT_URL}/fit-in/1920x0/{album_slug}/{photo.filename}"
+    for row in rows:
+        file_metadata = {
+            "id": row.id,
+            "album_id": row.album_id,
+            "name": row.filename,
+            "slug": row.slug,
+            "location": row.content_type,
+            "date": row.size,
+            "upload_date": row.upload_date,
+        }
+        if fields == "full":
+            file_metadata["exif_data"] = row.exif_data
+        file_metadata["blur_data_url"] = row.blur_data_url
         face_photos.append(
             {
-                "image": image_url,
-                "compressed_image": compressed_image_url,
-                "file_metadata": {
-                    "id": photo.id,
-                    "album_id": photo.album_id,
-                    "name": photo.filename,
-                    "slug": album_slug,
-                    "location": photo.content_type,
-                    "date": photo.size,
-                    "upload_date": photo.upload_date,
-                    "exif_data": photo.exif_data,
-                    "blur_data_url": photo.blur_data_url,
-                },
+                "image": detail_url(f"{row.slug}/{row.filename}"),
+                "compressed_image": grid_url(f"{row.slug}/{row.filename}"),
+                "file_metadata": file_metadata,
             }
         )
 
-    return {
-        "id": face.id,
-        "name": face.name,
-        "external_id": face.external_id,
-        "face_photos": face_photos,
-    }
+    return FastJSONResponse(
+        {
+            "id": face.id,
+            "name": face.name,
+            "external_id": face.external_id,
+            "face_photos": face_photos,
+        }
+    )
 
 
 @router.put("/api/face/{face_id}")
@@ -17,18 +17,20 @@ from config import settings
 from db.base import get_session, session_scope
 from db.models import Album, FileMetadata, User, PhotoFaceLink, FaceEmbedding
 from services.aws_service import s3_client, invalidate_cdn
-from utils.face_recog import detect_and_store_faces, recluster_faces
-from utils.utils import get_file_metadata, add_album_to_user
-from utils.image_utils import generate_blur_data_url
+from utils.face_recog import recluster_photos
+from services.face_indexing import index_faces
+from services.photo_ingest import ingest_images
+from utils.utils import add_album_to_user
 from services.cdn_warm import warm_key
 from services.video_transcode import transcode_to_web
 from routers.websocket.websocket_router import manager
-from services import upload_jobs
+from services import gallery_cache, upload_jobs
 from dependencies import oauth2_scheme, get_current_user, require_admin
 from services.gemini_service import analyze_image
 from fastapi.responses import StreamingResponse
 import asyncio
-import io
+import shutil
+import tempfile
 import zipfile
 import mimetypes
 
@@ -42,13 +44,8 @@ _IMAGE_EXTS = {
 }
 _VIDEO_EXTS = {".mp4", ".mov", ".m4v", ".avi", ".mkv"}
 
-
-class _BytesUpload:
-    """Minimal stand-in for UploadFile so get_file_metadata can read exif
-    from bytes (zip entries aren't UploadFile objects)."""
-
-    def __init__(self, content: bytes):
-        self.file = io.BytesIO(content)
+# a zip entry is extracted into memory up to this size, to a temp file beyond
+_ZIP_SPOOL_MAX = 32 * 1024 * 1024
 
 
 def _guess_content_type(filename: str) -> str:
@@ -64,7 +61,7 @@ def _is_media(filename: str) -> bool:
     return ext in _IMAGE_EXTS or ext in _VIDEO_EXTS
 
 
-async def _store_video_file(file, filename: str, content_type: str, album, session):
+async def _store_video_file(fp, filename: str, content_type: str, album, session):
     """Stream a video to S3 in constant memory (no full read, no blur/exif/
     faces). A big video read into RAM OOM-killed the pod; videos just need to
     land in the album so the gallery + lightbox can play them.
@@ -74,12 +71,12 @@ async def _store_video_file(file, filename: str, content_type: str, album, sessi
     k8s kills the pod mid-upload."""
     s3_key = f"{album.slug}/{filename}"
     # measure size without loading the file into memory
-    file.file.seek(0, os.SEEK_END)
-    size = file.file.tell()
-    file.file.seek(0)
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
     await asyncio.to_thread(
         s3_client.upload_fileobj,
-        file.file, AWS_BUCKET, s3_key, {"ContentType": content_type},
+        fp, AWS_BUCKET, s3_key, {"ContentType": content_type},
     )
 
     existing = (
@@ -87,12 +84,14 @@ async def _store_video_file(file, filename: str, content_type: str, album, sessi
         .filter_by(album_id=album.id, filename=filename)
         .first()
     )
+    now = datetime.now()
     fields = dict(
         content_type=content_type,
         size=size,
         width=0,
         height=0,
-        upload_date=datetime.now(),
+        upload_date=now,
+        captured_at=now,
     )
     if existing:
         for k, v in fields.items():
@@ -107,90 +106,6 @@ async def _store_video_file(file, filename: str, content_type: str, album, sessi
     return s3_key, meta.id
 
 
-def _store_one_file(
-    content: bytes,
-    filename: str,
-    content_type: str,
-    album,
-    session,
-    face_detection: bool,
-    face_targets: list,
-    keys: list,
-):
-    """Save a single file to S3 + record metadata. Shared by the multi-file
-    upload and the zip upload so both run the identical pipeline.
-    Appends to face_targets / keys for the downstream faces + warm passes."""
-    is_video = (content_type or "").startswith("video/")
-
-    album_dir = os.path.join(settings.DATA_DIR, album.slug)
-    os.makedirs(album_dir, exist_ok=True)
-    local_path = os.path.join(album_dir, filename)
-    with open(local_path, "wb") as f:
-        f.write(content)
-
-    s3_filename = f"{album.slug}/{filename}"
-    s3_client.put_object(
-        Bucket=AWS_BUCKET,
-        Key=s3_filename,
-        Body=content,
-        ContentType=content_type,
-    )
-
-    try:
-        # re-uploading the same filename UPDATES the existing row (don't add a
-        # duplicate); the bumped upload_date also versions the image URL so the
-        # browser fetches the new file instead of its year-old cached copy
-        existing = (
-            session.query(FileMetadata)
-            .filter_by(album_id=album.id, filename=filename)
-            .first()
-        )
-
-        if is_video:
-            fields = dict(
-                content_type=content_type,
-                size=len(content),
-                width=0,
-                height=0,
-                upload_date=datetime.now(),
-            )
-        else:
-            keys.append(s3_filename)
-            fm = get_file_metadata(album.id, local_path, _BytesUpload(content))
-            fields = dict(
-                content_type=content_type,
-                size=fm["size"],
-                width=fm["width"],
-                height=fm["height"],
-                upload_date=datetime.now(),
-                exif_data=fm["exif_data"],
-                orientation=fm["orientation"],
-            )
-
-        if existing:
-            for k, v in fields.items():
-                setattr(existing, k, v)
-            meta = existing
-            # the photo changed — drop its old face data so it re-detects clean
-            session.query(PhotoFaceLink).filter_by(photo_id=meta.id).delete()
-            session.query(FaceEmbedding).filter_by(photo_id=meta.id).delete()
-        else:
-            meta = FileMetadata(album_id=album.id, filename=filename, **fields)
-            session.add(meta)
-        session.commit()
-        session.refresh(meta)
-
-        if not is_video:
-            meta.blur_data_url = generate_blur_data_url(content)
-            session.commit()
-
-            if face_detection:
-                face_targets.append((s3_filename, meta.id))
-    finally:
-        if os.path.exists(local_path):
-            os.remove(local_path)
-
-
 async def _notify(stage: str, current: int = 0, total: int = 0):
     """Push a live stage update to the upload dialog over the websocket."""
     conns = manager.active_connections
@@ -240,28 +155,33 @@ async def create_upload_files(
         add_album_to_user(user_id, album.id)
 
     total = len(files)
-    # (s3_key, file_metadata_id) for the faces pass
-    face_targets = []
-    keys = []  # image keys to warm (videos aren't transformed/warmed)
     video_targets = []  # (s3_key, meta_id) to transcode to web-friendly mp4
+    images = []
+    saved = 0
 
     # stage 1: save each file to S3 + (for images) record metadata + blur.
     # This is the only work that needs the request body, so it stays inline.
-    for i, file in enumerate(files):
+    for file in files:
         ctype = file.content_type or _guess_content_type(file.filename)
         if (ctype or "").startswith("video/"):
             # stream videos straight to S3 — reading a big one into the pod's
             # memory OOM-killed the backend. no blur/exif/faces for video.
             video_targets.append(
-                await _store_video_file(file, file.filename, ctype, album, session)
+                await _store_video_file(file.file, file.filename, ctype, album, session)
             )
+            saved += 1
+            await _notify("saving", saved, total)
         else:
-            content = await file.read()
-            _store_one_file(
-                content, file.filename, ctype, album,
-                session, face_detection, face_targets, keys,
-            )
-        await _notify("saving", i + 1, total)
+            images.append((file.filename, ctype, file.file.read))
+
+    # images: concurrent S3 puts + metadata analysis, one batched DB write
+    async def _saving(done, _n):
+        await _notify("saving", saved + done, total)
+
+    stored = await ingest_images(images, album, _saving)
+    # (s3_key, file_metadata_id) for the faces pass
+    face_targets = stored if face_detection else []
+    keys = [k for k, _ in stored]  # image keys to warm (videos aren't warmed)
 
     # keep image_count exact (= actual stored rows), regardless of new/append
     album.image_count = (
@@ -269,6 +189,7 @@ async def create_upload_files(
     )
     session.commit()
     image_count = album.image_count
+    gallery_cache.invalidate(gallery_cache.album_tag(album.slug))
 
     # faces + clustering + cdn warming can run for minutes on a big album —
     # well past any proxy timeout. Hand them to a background task and return
@@ -306,23 +227,23 @@ async def _process_album(
             n = len(face_targets)
             upload_jobs.update_job(album_slug, phase="faces", current=0, total=n)
             await _notify("faces", 0, n)
-            for i, (s3_key, meta_id) in enumerate(face_targets):
-                # one bad photo must never abort the whole album — log & continue
-                try:
-                    await asyncio.to_thread(
-                        detect_and_store_faces, s3_key, meta_id, album_id, AWS_BUCKET
-                    )
-                except Exception as e:
-                    print(f"face detection failed for {s3_key}: {e}")
-                upload_jobs.update_job(album_slug, phase="faces", current=i + 1, total=n)
-                await _notify("faces", i + 1, n)
 
-            # authoritative regroup (Chinese Whispers); never fatal — detect
-            # already wrote consistent links, recluster only refines them.
+            async def _progress(done, total):
+                upload_jobs.update_job(album_slug, phase="faces", current=done, total=total)
+                await _notify("faces", done, total)
+
+            # bounded worker pool over /embed/batch chunks, with retry/backoff
+            await index_faces(face_targets, album_id, AWS_BUCKET, _progress)
+
+            # regroup the people these photos touch (Chinese Whispers); never
+            # fatal — detect already wrote consistent links, recluster only
+            # refines them.
             upload_jobs.update_job(album_slug, phase="clustering")
             await _notify("clustering", 0, 0)
             try:
-                await asyncio.to_thread(recluster_faces)
+                await asyncio.to_thread(
+                    recluster_photos, [pid for _, pid in face_targets]
+                )
             except Exception as e:
                 print(f"recluster after upload failed (non-fatal): {e}")
 
@@ -352,6 +273,7 @@ async def _process_album(
                         m = s.query(FileMetadata).filter_by(id=meta_id).first()
                         if m:
                             m.size = new_size
+                    gallery_cache.invalidate(gallery_cache.album_tag(album_slug))
                     await asyncio.to_thread(invalidate_cdn)
             except Exception as e:
                 print(f"video transcode failed for {s3_key}: {e}")
@@ -387,6 +309,29 @@ async def upload_status(album_slug: str, current_user=Depends(require_admin)):
     return {"album_slug": album_slug, "active": not job["finished"], **job}
 
 
+def _spool_entry(zf, name):
+    """Extract one zip entry into a seekable temp file (in memory while small,
+    on disk beyond _ZIP_SPOOL_MAX), copying in fixed-size chunks."""
+    out = tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_MAX)
+    with zf.open(name) as src:
+        shutil.copyfileobj(src, out, 1024 * 1024)
+    out.seek(0)
+    return out
+
+
+def _extract_entry(zf, name):
+    """Extract one zip entry to a temp file on disk, copying in fixed-size
+    chunks, and return its path (ingest_images deletes it)."""
+    out = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        with out, zf.open(name) as src:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+    except BaseException:
+        os.unlink(out.name)
+        raise
+    return out.name
+
+
 @router.post("/api/upload-zip/")
 async def create_upload_zip(
     file: UploadFile = File(...),
@@ -397,13 +342,21 @@ async def create_upload_zip(
     session: Session = Depends(get_session),
 ):
     """Bulk-upload an album from a single .zip of original files. Each entry
-    runs through the same pipeline as /api/upload-files/ (S3, metadata, blur,
-    faces, CDN warm)."""
+    runs through the same pipeline as /api/upload-files/ (S3, metadata, blur),
+    then faces, CDN warming and video transcodes run in the same background
+    job.
+
+    The archive is never read into memory: the upload is already spooled to
+    disk by the server and the zip directory is read from there. Videos are
+    extracted into a bounded temp file and streamed on to S3; images are
+    extracted to temp files on disk a few entries at a time by the ingest
+    stage, which uploads and analyses them from there."""
     if not album_name:
         raise HTTPException(status_code=400, detail="album_name is required")
 
     album_slug = album_name.lower().replace(" ", "-")
     album = session.query(Album).filter_by(slug=album_slug).first()
+    update = album is not None
     if not album:
         album = Album(
             name=album_name,
@@ -423,9 +376,10 @@ async def create_upload_zip(
     if user_id and album:
         add_album_to_user(user_id, album.id)
 
-    raw = await file.read()
     try:
-        zf = zipfile.ZipFile(io.BytesIO(raw))
+        # seeks through the (possibly multi-GB) spooled upload to parse the
+        # central directory — keep that off the event loop too
+        zf = await asyncio.to_thread(zipfile.ZipFile, file.file)
     except zipfile.BadZipFile:
         raise HTTPException(status_code=400, detail="That file isn't a valid zip.")
 
@@ -443,54 +397,66 @@ async def create_upload_zip(
             status_code=400, detail="No photos or videos found in the zip."
         )
 
-    face_targets = []
-    keys = []
+    video_targets = []
+    images = []
+    saved = 0
 
-    # stage 1: extract + store each entry
-    for i, name in enumerate(entries):
-        content = zf.read(name)
+    # stage 1: extract + store each entry. videos are spooled off the event
+    # loop so a multi-GB entry can't starve the liveness probe; images are
+    # extracted entry by entry (a few at a time) by the concurrent ingest stage.
+    for name in entries:
         filename = os.path.basename(name)
         ctype = _guess_content_type(filename)
-        _store_one_file(
-            content, filename, ctype, album,
-            session, face_detection, face_targets, keys,
-        )
-        await _notify("saving", i + 1, total)
+        if ctype.startswith("video/"):
+            entry = await asyncio.to_thread(_spool_entry, zf, name)
+            try:
+                video_targets.append(
+                    await _store_video_file(entry, filename, ctype, album, session)
+                )
+            finally:
+                entry.close()
+            saved += 1
+            await _notify("saving", saved, total)
+        else:
+            images.append((filename, ctype, lambda name=name: _extract_entry(zf, name)))
+
+    async def _saving(done, _n):
+        await _notify("saving", saved + done, total)
+
+    stored = await ingest_images(images, album, _saving)
+    zf.close()
+    face_targets = stored if face_detection else []
+    keys = [k for k, _ in stored]
 
     album.image_count = (
         session.query(FileMetadata).filter_by(album_id=album.id).count()
     )
     session.commit()
+    image_count = album.image_count
+    gallery_cache.invalidate(gallery_cache.album_tag(album.slug))
 
-    # stage 2: faces
-    if face_targets:
-        n = len(face_targets)
-        for i, (s3_key, meta_id) in enumerate(face_targets):
-            # one bad photo (no detectable face, odd crop, etc.) must never
-            # 500 the whole upload — log and keep going
-            try:
-                await asyncio.to_thread(
-                    detect_and_store_faces, s3_key, meta_id, album.id, AWS_BUCKET
-                )
-            except Exception as e:
-                print(f"face detection failed for {s3_key}: {e}")
-            await _notify("faces", i + 1, n)
-        # authoritative regroup (Chinese Whispers) so a new upload can't leave
-        # people mis-merged; cheap on reruns (stable ids + chips reused)
-        await asyncio.to_thread(recluster_faces)
-
-    # stage 3: warm CDN derivatives
-    done = 0
-    tasks = [asyncio.create_task(asyncio.to_thread(warm_key, k)) for k in keys]
-    await _notify("warming", 0, total)
-    for task in asyncio.as_completed(tasks):
-        await task
-        done += 1
-        await _notify("warming", done, total)
-
-    await _notify("done", total, total)
+    # faces, clustering, warming and transcodes go to the background job, as
+    # for /api/upload-files/ — a big zip would otherwise outlive the proxy
+    processing = bool(face_targets or keys or video_targets)
+    if processing:
+        upload_jobs.start_job(
+            album_slug, face_detection=bool(face_targets), image_count=image_count
+        )
+        asyncio.create_task(
+            _process_album(
+                album.id, album_slug, face_targets, keys, update, image_count,
+                video_targets,
+            )
+        )
+    else:
+        await _notify("done", total, total)
 
-    return {"album": album.slug, "count": total}
+    return {
+        "album": album.slug,
+        "album_slug": album.slug,
+        "count": total,
+        "processing": processing,
+    }
 
 
 @router.post("/api/label-photos")
@@ -528,6 +494,7 @@ async def label_all_photos(current_user=Depends(require_admin)):
                         }
                     )
                     session.commit()
+                    gallery_cache.invalidate(gallery_cache.album_tag(album.slug))
 
                     yield json.dumps({
                         "progress": i + 1,
@@ -579,6 +546,8 @@ async def label_single_photo(
     session.query(FileMetadata).filter_by(id=photo_id).update(
         {"description": result["description"], "tags": result["tags"]}
     )
+    session.commit()
+    gallery_cache.invalidate(gallery_cache.album_tag(slug))
 
     return {
         "id": photo_id,
@@ -8,7 +8,12 @@ from sqlalchemy.orm import Session
 from models.user import User, UpdateUserForm
 from db.base import get_session, session_scope
 from db.models import User as UserModel, UserAlbumPermission, Album, UserEmail
-from dependencies import oauth2_scheme, get_current_user, require_admin
+from dependencies import (
+    oauth2_scheme,
+    get_current_user,
+    invalidate_user_access,
+    require_admin,
+)
 from routers.auth.auth_router import (
     create_token,
     get_password_hash,
@@ -143,7 +148,8 @@ def update_me(
         if trimmed:
             me.full_name = trimmed
 
-    session.flush()
+    session.commit()
+    invalidate_user_access(me.id)
     return {
         "id": me.id,
         "user_name": me.user_name,
@@ -266,6 +272,8 @@ def delete_my_account(
     if hasattr(me, "deleted_at"):
         from datetime import datetime
         me.deleted_at = datetime.now()
+    session.commit()
+    invalidate_user_access(me.id)
 
     return {"message": "Account deleted."}
 
@@ -321,7 +329,8 @@ def grant_album_access(
     )
     if not existing:
         session.add(UserAlbumPermission(user_id=user.id, album_id=album.id))
-        session.flush()
+        session.commit()
+        invalidate_user_access(user.id)
     return {"message": "Access granted", "user_id": user.id, "album_id": album.id}
 
 
@@ -339,6 +348,8 @@ def revoke_album_access(
     session.query(UserAlbumPermission).filter_by(
         user_id=user_id, album_id=album.id
     ).delete()
+    session.commit()
+    invalidate_user_access(user_id)
     return {"message": "Access revoked"}
 
 
@@ -401,6 +412,8 @@ def invite_client(
     )
     if not exists:
         session.add(UserAlbumPermission(user_id=user.id, album_id=album.id))
+        session.commit()
+        invalidate_user_access(user.id)
 
     token = issue_magic_link(session, user, "invite")
     import os
@@ -575,6 +588,8 @@ def update_user(
     session.query(UserAlbumPermission).filter_by(user_id=user_id).delete()
     for album_id in form_data.album_ids:
         session.add(UserAlbumPermission(user_id=user_id, album_id=album_id))
+    session.commit()
+    invalidate_user_access(user_id)
 
     return {"message": "User updated successfully."}
 
@@ -609,6 +624,7 @@ def delete_user(
     )
     session.query(UserModel).filter_by(id=user_id).delete()
     session.commit()
+    invalidate_user_access(user_id)
     return {"message": "User deleted successfully."}
 
 
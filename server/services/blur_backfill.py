@@ -0,0 +1,175 @@
+"""Resumable blur_data_url backfill for photos uploaded before placeholders
+existed.
+
+Rows are read in keyset pages (id > last id, ORDER BY id) so a run never
+loads the whole table. Each page is downloaded + decoded on a worker pool
+(draft-mode decodes — the placeholder is 10x10, so a 50 MP JPEG is decoded
+at 1/8 scale) and written back with one UPDATE ... FROM (VALUES ...). After
+every committed page the checkpoint file records how far the run got, so an
+interrupted run picks up where it stopped. A photo that failed holds the
+checkpoint just below its id, so the next run retries it (the rows past it
+that were written no longer match the blur IS NULL filter).
+
+Runs from the CLI (python -m scripts.backfill_blur) or as an admin-triggered
+background job (/api/admin/backfill-blur), which reports progress.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Integer, Text, column, func, select, update, values
+
+from config import settings
+from db.base import session_scope
+from db.models import Album, FileMetadata
+from services import gallery_cache
+from services.aws_service import s3_client
+from utils.image_utils import render_blur_data_url
+
+AWS_BUCKET = settings.AWS_BUCKET
+
+BLUR_BACKFILL_WORKERS = int(os.environ.get("BLUR_BACKFILL_WORKERS", "8"))
+BLUR_BACKFILL_PAGE = int(os.environ.get("BLUR_BACKFILL_PAGE", "200"))
+BLUR_BACKFILL_CHECKPOINT = os.environ.get(
+    "BLUR_BACKFILL_CHECKPOINT",
+    os.path.join(settings.STATE_DIR, "blur_backfill.json"),
+)
+
+# progress of the current / last run in this process
+_state = {
+    "running": False,
+    "done": 0,
+    "total": 0,
+    "updated": 0,
+    "failed": 0,
+    "last_id": 0,
+    "error": None,
+    "started_at": None,
+    "updated_at": None,
+}
+_lock = threading.Lock()
+
+
+def status():
+    with _lock:
+        return dict(_state)
+
+
+def _set(**fields):
+    with _lock:
+        _state.update(fields, updated_at=time.time())
+
+
+def _load_checkpoint():
+    try:
+        with open(BLUR_BACKFILL_CHECKPOINT) as f:
+            return int(json.load(f).get("last_id", 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def _save_checkpoint(last_id):
+    os.makedirs(os.path.dirname(BLUR_BACKFILL_CHECKPOINT) or ".", exist_ok=True)
+    tmp = f"{BLUR_BACKFILL_CHECKPOINT}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"last_id": last_id, "at": time.time()}, f)
+    os.replace(tmp, BLUR_BACKFILL_CHECKPOINT)  # atomic: never a torn checkpoint
+
+
+def _pending(after_id):
+    return (
+        select(FileMetadata.id, Album.slug, FileMetadata.filename)
+        .join(Album, FileMetadata.album_id == Album.id)
+        .where(
+            FileMetadata.blur_data_url.is_(None),
+            FileMetadata.id > after_id,
+            ~func.coalesce(FileMetadata.content_type, "").ilike("video/%"),
+        )
+    )
+
+
+def _blur_one(row):
+    """(id, data URL) or (id, None) if the photo can't be fetched or decoded
+    — a failure is left NULL to retry, not stamped with a placeholder."""
+    key = f"{row.slug}/{row.filename}"
+    try:
+        body = s3_client.get_object(Bucket=AWS_BUCKET, Key=key)["Body"]
+        return row.id, render_blur_data_url(body.read())
+    except Exception as e:
+        print(f"blur backfill: {key}: {e}")
+        return row.id, None
+
+
+def _write_page(session, blurs):
+    """One UPDATE ... FROM (VALUES (id, blur), ...) for the whole page."""
+    v = values(column("id", Integer), column("blur", Text), name="v").data(blurs)
+    session.execute(
+        update(FileMetadata)
+        .where(FileMetadata.id == v.c.id)
+        .values(blur_data_url=v.c.blur)
+    )
+    session.commit()
+
+
+def run(workers=BLUR_BACKFILL_WORKERS, restart=False, page=BLUR_BACKFILL_PAGE):
+    """Backfill every photo without a placeholder, resuming from the
+    checkpoint unless `restart`. Blocking; returns the final status."""
+    with _lock:
+        if _state["running"]:
+            raise RuntimeError("blur backfill already running")
+        _state.update(
+            running=True, done=0, total=0, updated=0, failed=0, error=None,
+            started_at=time.time(), updated_at=time.time(),
+        )
+    last_id = 0 if restart else _load_checkpoint()
+    resume_id = None  # checkpoint pinned below this run's first failure
+    try:
+        with session_scope() as session:
+            total = session.execute(
+                select(func.count()).select_from(_pending(last_id).subquery())
+            ).scalar()
+            _set(total=total, last_id=last_id)
+            print(f"blur backfill: {total} photos to do (after id {last_id})")
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    rows = session.execute(
+                        _pending(last_id).order_by(FileMetadata.id).limit(page)
+                    ).all()
+                    if not rows:
+                        break
+                    results = list(pool.map(_blur_one, rows))
+                    blurs = [(pid, blur) for pid, blur in results if blur]
+                    if blurs:
+                        _write_page(session, blurs)
+                        # placeholders are in the gallery JSON of these albums
+                        written = {pid for pid, _ in blurs}
+                        gallery_cache.invalidate(*{
+                            gallery_cache.album_tag(r.slug)
+                            for r in rows if r.id in written
+                        })
+                    failed = [pid for pid, blur in results if not blur]
+                    if failed and resume_id is None:
+                        resume_id = failed[0] - 1  # rows come ordered by id
+                    last_id = rows[-1].id
+                    _save_checkpoint(last_id if resume_id is None else resume_id)
+                    st = status()
+                    _set(
+                        done=st["done"] + len(rows),
+                        updated=st["updated"] + len(blurs),
+                        failed=st["failed"] + len(rows) - len(blurs),
+                        last_id=last_id,
+                    )
+                    print(
+                        f"blur backfill: {st['done'] + len(rows)}/{total} "
+                        f"(last id {last_id})"
+                    )
+    except Exception as e:
+        _set(error=str(e))
+        raise
+    finally:
+        _set(running=False)
+    return status()
@@ -0,0 +1,295 @@
+"""Shared cache for the API server.
+
+One backend per process, picked from CACHE_URL:
+
+  (unset)           in-process LRU bounded by CACHE_MAX_MB of stored bytes,
+                    with per-entry TTLs (cachetools.TLRUCache)
+  redis://host/db   any Redis-protocol server (Redis, Valkey, KeyDB...), so
+                    several uvicorn workers or replicas share entries. Needs
+                    the optional `redis` package; without it we fall back to
+                    the in-process LRU.
+
+Callers work through a Namespace — cache.namespace("gallery") — which owns
+its keys, default TTL and hit/miss counters:
+
+  ns.get(key) / ns.set(key, value, ttl=None, tags=())   explicit keys
+  ns.get_or_set(key, build)                            read-through
+  @ns.cached(key=lambda album_id: album_id)             decorator
+
+Values are pickled, so anything picklable can be stored; bytes are the
+cheapest. Invalidation is by tag: an entry remembers the version of every tag
+it was stored with, and ns.invalidate(tag) bumps that version, so stale
+entries miss on their next read wherever they live. ns.clear() drops the
+whole namespace the same way. Tag versions are counters the LRU never
+evicts, which is what keeps that check sound.
+"""
+
+import functools
+import inspect
+import logging
+import os
+import pickle
+import threading
+import time
+
+from cachetools import TLRUCache
+
+try:
+    import redis
+except ImportError:  # optional — only needed for a shared cache
+    redis = None
+
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_MB", "128")) * 1024 * 1024
+CACHE_DEFAULT_TTL = int(os.environ.get("CACHE_DEFAULT_TTL", "3600"))
+
+_ALL = "*"  # implicit tag on every entry; bumping it clears the namespace
+_WRITES = "#writes"  # bumped by every invalidation, for set(since=...)
+
+
+class MemoryBackend:
+    """Byte-bounded LRU with per-entry expiry. Thread-safe."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, timer=time.monotonic):
+        self.max_bytes = max_bytes
+        self._items = TLRUCache(
+            maxsize=max_bytes,
+            ttu=lambda _key, value, now: now + value[1],
+            getsizeof=lambda value: len(value[0]),
+            timer=timer,
+        )
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+        return value[0] if value is not None else None
+
+    def set(self, key, data, ttl):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._items[key] = (data, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def counters(self, keys):
+        with self._lock:
+            return [self._counters.get(k, 0) for k in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._items),
+                "bytes": int(self._items.currsize),
+                "max_bytes": self.max_bytes,
+            }
+
+
+class RedisBackend:
+    """Any Redis-protocol server. Entries use SET EX; tag versions are plain
+    counters (INCR) with no expiry."""
+
+    def __init__(self, url):
+        self._r = redis.Redis.from_url(url)
+        self.url = url
+
+    def get(self, key):
+        return self._r.get(key)
+
+    def set(self, key, data, ttl):
+        self._r.set(key, data, ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self._r.delete(key)
+
+    def counters(self, keys):
+        return [int(v or 0) for v in self._r.mget(keys)]
+
+    def incr(self, key):
+        return self._r.incr(key)
+
+    def stats(self):
+        try:
+            info = self._r.info("memory")
+            return {
+                "backend": "redis",
+                "entries": self._r.dbsize(),
+                "bytes": info.get("used_memory"),
+                "max_bytes": info.get("maxmemory") or None,
+            }
+        except Exception as e:
+            return {"backend": "redis", "error": str(e)}
+
+
+def _make_backend():
+    if CACHE_URL.startswith(("redis://", "rediss://", "unix://")):
+        if redis is not None:
+            return RedisBackend(CACHE_URL)
+        logging.warning(
+            "cache: CACHE_URL set but the redis package isn't installed — "
+            "using the in-process LRU"
+        )
+    return MemoryBackend()
+
+
+_backend = _make_backend()
+_namespaces = {}
+_ns_lock = threading.Lock()
+
+
+def configure(backend):
+    """Swap the process-wide backend (e.g. a local fake in tests). Existing
+    namespaces pick it up immediately."""
+    global _backend
+    _backend = backend
+
+
+class Namespace:
+    def __init__(self, name, ttl=CACHE_DEFAULT_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def _tag(self, tag):
+        return f"{self.name}#tag:{tag}"
+
+    # -- explicit keys ----------------------------------------------------------
+
+    def version(self):
+        """Token taken before building a value; pass it to set(since=...) and
+        the value is dropped if anything in the namespace was invalidated in
+        between (a build that raced a write)."""
+        return _backend.counters([self._tag(_WRITES)])[0]
+
+    def get(self, key, default=None):
+        raw = _backend.get(self._key(key))
+        if raw is not None:
+            value, versions = pickle.loads(raw)
+            tags = list(versions)
+            current = _backend.counters([self._tag(t) for t in tags])
+            if current == [versions[t] for t in tags]:
+                self.hits += 1
+                return value
+            _backend.delete(self._key(key))
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None, tags=(), since=None):
+        tags = [_ALL, *tags]
+        writes, *current = _backend.counters(
+            [self._tag(_WRITES), *(self._tag(t) for t in tags)]
+        )
+        if since is not None and writes != since:
+            return value
+        raw = pickle.dumps(
+            (value, dict(zip(tags, current))), protocol=pickle.HIGHEST_PROTOCOL
+        )
+        _backend.set(self._key(key), raw, ttl or self.ttl)
+        return value
+
+    def get_or_set(self, key, build, ttl=None, tags=()):
+        """Cached value for `key`, calling build() on a miss. build may
+        return (value, tags) when tags are only known once it has run —
+        pass tags=None for that form."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        since = self.version()
+        value = build()
+        if tags is None:
+            value, tags = value
+        return self.set(key, value, ttl, tags, since)
+
+    def delete(self, key):
+        _backend.delete(self._key(key))
+
+    def invalidate(self, *tags):
+        """Every entry stored with any of `tags` misses from now on."""
+        for tag in tags:
+            _backend.incr(self._tag(tag))
+        _backend.incr(self._tag(_WRITES))
+
+    def clear(self):
+        self.invalidate(_ALL)
+
+    # -- decorator --------------------------------------------------------------
+
+    def cached(self, key=None, ttl=None, tags=()):
+        """Cache a function's return value. `key` maps the call's arguments
+        to a cache key (default: their repr); `tags` is a tuple, or a
+        callable of the same arguments returning one. Works on plain and
+        async functions."""
+
+        def decorate(fn):
+            def make_key(args, kwargs):
+                return key(*args, **kwargs) if key else f"{fn.__qualname__}{args!r}{kwargs!r}"
+
+            def make_tags(args, kwargs):
+                return tags(*args, **kwargs) if callable(tags) else tags
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    k = make_key(args, kwargs)
+                    missing = object()
+                    value = self.get(k, missing)
+                    if value is missing:
+                        since = self.version()
+                        value = await fn(*args, **kwargs)
+                        self.set(k, value, ttl, make_tags(args, kwargs), since)
+                    return value
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    return self.get_or_set(
+                        make_key(args, kwargs),
+                        lambda: fn(*args, **kwargs),
+                        ttl,
+                        make_tags(args, kwargs),
+                    )
+
+            wrapper.cache = self
+            return wrapper
+
+        return decorate
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "ttl": self.ttl,
+        }
+
+
+def namespace(name, ttl=CACHE_DEFAULT_TTL):
+    """The process-wide Namespace called `name` (created on first use)."""
+    with _ns_lock:
+        ns = _namespaces.get(name)
+        if ns is None:
+            ns = _namespaces[name] = Namespace(name, ttl)
+        return ns
+
+
+def stats():
+    """Backend usage plus hit/miss counters per namespace (this process)."""
+    return {
+        **_backend.stats(),
+        "namespaces": {name: ns.stats() for name, ns in sorted(_namespaces.items())},
+    }
@@ -0,0 +1,129 @@
+"""Face indexing stage shared by uploads, zip uploads and album resyncs.
+
+Photos go to the face service in /embed/batch chunks, pulled off a queue by a
+bounded pool of workers. With a few chunks in flight the GPU box always has
+the next batch queued while we write the previous one to Postgres, instead of
+idling between round-trips. Transient face-service failures (connection
+drops, timeouts, 5xx/429 while the pod restarts) are retried with jittered
+exponential backoff; anything else is logged and the photo skipped — one bad
+photo never aborts an album. A chunk whose Postgres write fails keeps its
+buffered rows and is retried the same way; one that still can't be written is
+logged and left out of the returned count.
+"""
+
+import asyncio
+import os
+import random
+
+import requests
+
+from utils.face_recog import (
+    detect_and_store_faces,
+    embed_images,
+    FaceWriter,
+    FACE_EMBED_BATCH,
+)
+
+# chunks in flight at once — enough to keep the GPU busy without flooding it
+FACE_INDEX_CONCURRENCY = int(os.environ.get("FACE_INDEX_CONCURRENCY", "3"))
+FACE_INDEX_RETRIES = int(os.environ.get("FACE_INDEX_RETRIES", "3"))
+FACE_INDEX_BACKOFF = float(os.environ.get("FACE_INDEX_BACKOFF", "2.0"))  # seconds
+
+
+def _retryable(e):
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return False
+
+
+async def _with_retry(label, fn, *args):
+    """Run a blocking face-service call off the loop, retrying transient errors.
+    Only the HTTP call can raise a retryable error, and it happens before any
+    row is buffered, so a retry never double-inserts."""
+    for attempt in range(FACE_INDEX_RETRIES + 1):
+        try:
+            return await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            if attempt >= FACE_INDEX_RETRIES or not _retryable(e):
+                raise
+            delay = _backoff(attempt)
+            print(f"face service unavailable for {label} ({e}); retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def _backoff(attempt):
+    return FACE_INDEX_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+async def _flush(writer, n_photos):
+    """Commit a chunk's buffered rows, retrying a failed write (the writer
+    keeps its buffer on failure). Returns whether they were written."""
+    for attempt in range(FACE_INDEX_RETRIES + 1):
+        try:
+            await asyncio.to_thread(writer.flush)
+            return True
+        except Exception as e:
+            if attempt >= FACE_INDEX_RETRIES:
+                print(
+                    f"face write failed for {n_photos} photos after "
+                    f"{attempt + 1} attempts; their faces were not stored: {e}"
+                )
+                return False
+            delay = _backoff(attempt)
+            print(f"face write failed for {n_photos} photos ({e}); retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def index_faces(targets, album_id, bucket, on_progress=None):
+    """Detect + store faces for every (s3_key, photo_id) in `targets`.
+
+    `on_progress(done, total)` is awaited after each photo, serialized so the
+    counts it sees (and the websocket/job updates it sends) only ever go up.
+    Returns how many photos were indexed and written without error."""
+    total = len(targets)
+    queue = asyncio.Queue()
+    for start in range(0, total, FACE_EMBED_BATCH):
+        queue.put_nowait(targets[start:start + FACE_EMBED_BATCH])
+
+    progress_lock = asyncio.Lock()
+    done = ok = 0
+
+    async def worker():
+        nonlocal done, ok
+        while True:
+            try:
+                chunk = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            keys = [k for k, _ in chunk]
+            try:
+                results = await _with_retry(f"{len(keys)} photos", embed_images, bucket, keys)
+            except Exception as e:
+                # per-photo /embed below still gets a shot at each key
+                print(f"face batch failed, falling back per photo: {e}")
+                results = {}
+            # the chunk's rows are buffered and written in one transaction
+            writer = FaceWriter(bucket)
+            staged = 0
+            for s3_key, photo_id in chunk:
+                try:
+                    await _with_retry(
+                        s3_key, detect_and_store_faces,
+                        s3_key, photo_id, album_id, bucket, results.get(s3_key),
+                        writer,
+                    )
+                    staged += 1
+                except Exception as e:
+                    print(f"face detection failed for {s3_key}: {e}")
+                async with progress_lock:
+                    done += 1
+                    if on_progress:
+                        await on_progress(done, total)
+            if await _flush(writer, len(chunk)):
+                ok += staged
+
+    workers = min(FACE_INDEX_CONCURRENCY, queue.qsize())
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return ok
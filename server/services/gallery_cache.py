@@ -0,0 +1,80 @@
+"""Serialized-response cache for the public gallery endpoints.
+
+/api/album/{slug}/view and /api/category-albums[/{id}] are read far more
+often than albums change, so their JSON is rendered once and kept as bytes
+with an ETag. A warm hit never touches Postgres; a client that already has
+the body gets a 304.
+
+Every entry carries tags naming what it was built from — "album:{slug}" for
+each album whose photos it lists, "category:{id}", and "categories" for the
+category listing. Mutation paths call invalidate() with the tags they touch
+after committing. A build that raced an invalidation is not stored (the
+generation check in put()), so a stale body can't outlive the write.
+
+Stored in the "gallery" namespace of services.cache, so the entries are
+shared between workers when CACHE_URL points at Redis.
+"""
+
+import hashlib
+
+from fastapi import Request, Response
+
+from services import cache
+from utils.fast_json import dumps
+
+_ns = cache.namespace("gallery")
+
+
+def album_tag(slug):
+    return f"album:{slug}"
+
+
+def category_tag(category_id):
+    return f"category:{category_id}"
+
+
+CATEGORIES = "categories"
+
+
+def generation():
+    """Read before building an entry; hand it to put()."""
+    return _ns.version()
+
+
+def _key(key):
+    return ":".join(map(str, key))
+
+
+def get(key):
+    return _ns.get(_key(key))
+
+
+def put(key, payload, tags, gen, **meta):
+    """Render `payload` to JSON bytes and cache it under `key`. `meta` rides
+    along for checks a hit still has to make (e.g. a share secret). Returns
+    the entry; it's only stored if nothing was invalidated since `gen`."""
+    body = dumps(payload)
+    entry = {
+        "body": body,
+        "etag": '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest(),
+        **meta,
+    }
+    return _ns.set(_key(key), entry, tags=tags, since=gen)
+
+
+def invalidate(*tags):
+    """Drop every entry built from any of `tags`. Call after the commit."""
+    _ns.invalidate(*tags)
+
+
+def clear():
+    _ns.clear()
+
+
+def respond(request: Request, entry):
+    """The cached body, or 304 when the client's If-None-Match matches."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    sent = request.headers.get("if-none-match", "")
+    if entry["etag"] in (t.strip().removeprefix("W/") for t in sent.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type="application/json", headers=headers)
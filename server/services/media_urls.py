@@ -0,0 +1,60 @@
+"""URLs for media objects — CloudFront paths and S3 presigned GETs.
+
+CDN URLs are plain string joins against prefixes built once at import.
+Presigned URLs cost a full botocore signing pass each, and album loads and
+deliverable lists used to re-sign the same keys on every request; here each
+one is cached per (key, expiry, disposition) and reused for the first
+PRESIGN_REUSE fraction of its lifetime. A URL handed out therefore always
+has at least (1 - PRESIGN_REUSE) * expires left to run.
+
+They live in the "presign" namespace of services.cache, so they share its
+memory bound and stats, and every worker reuses them when CACHE_URL points
+at Redis.
+"""
+
+import os
+
+from config import settings
+from services import cache
+from services.aws_service import s3_client
+
+AWS_BUCKET = settings.AWS_BUCKET
+
+CDN_BASE = f"https://{settings.AWS_CLOUDFRONT_URL}/"
+GRID_BASE = f"{CDN_BASE}fit-in/720x0/"      # grid thumbnail
+DETAIL_BASE = f"{CDN_BASE}fit-in/1920x0/"   # detailed / lightbox view
+
+PRESIGN_REUSE = float(os.environ.get("PRESIGN_REUSE", "0.5"))
+
+# entries carry their own TTL (a fraction of the URL's expiry)
+_presigned = cache.namespace("presign")
+
+
+def cdn_url(key):
+    return CDN_BASE + key
+
+
+def grid_url(key):
+    return GRID_BASE + key
+
+
+def detail_url(key):
+    return DETAIL_BASE + key
+
+
+def presigned_get(key, expires=3600, filename=None):
+    """Presigned S3 GET for `key`, valid `expires` seconds from when it was
+    signed. `filename` makes it download as an attachment under that name."""
+    cache_key = f"{expires}:{filename or ''}:{key}"
+    url = _presigned.get(cache_key)
+    if url is not None:
+        return url
+
+    params = {"Bucket": AWS_BUCKET, "Key": key}
+    if filename:
+        params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+    url = s3_client.generate_presigned_url(
+        "get_object", Params=params, ExpiresIn=expires
+    )
+    return _presigned.set(cache_key, url, ttl=expires * PRESIGN_REUSE)
+
@@ -0,0 +1,152 @@
+"""Concurrent stage 1 for image uploads (multi-file and zip).
+
+Each image goes to S3 on a bounded thread pool while its metadata (exif,
+dimensions, orientation, blur) is computed on a process pool — PIL decoding
+is CPU-bound and would otherwise hold the GIL and stall the event loop the
+liveness probe is answered from. Rows are written to Postgres in one batch
+once every file has landed, so an upload costs roughly its slowest few S3
+PUTs instead of the sum of every PUT, decode and commit.
+
+An item's bytes can also come as a temp file on disk (zip entries do), which
+is uploaded and analysed from the file so the image is never held in memory.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+from config import settings
+from db.base import session_scope
+from db.models import FaceEmbedding, FileMetadata, PhotoFaceLink
+from services.aws_service import s3_client
+from utils.image_utils import inspect_image
+
+AWS_BUCKET = settings.AWS_BUCKET
+
+# files held in memory at once (read, uploading, being analysed)
+INGEST_CONCURRENCY = int(os.environ.get("INGEST_CONCURRENCY", "8"))
+INGEST_S3_WORKERS = int(os.environ.get("INGEST_S3_WORKERS", "8"))
+INGEST_ANALYZE_WORKERS = int(os.environ.get("INGEST_ANALYZE_WORKERS", "2"))
+
+_s3_pool = ThreadPoolExecutor(max_workers=INGEST_S3_WORKERS)
+_analyze_pool = None
+
+
+def _analyzer():
+    # created on first upload; spawn so workers don't inherit the app's DB
+    # connections, threads or open sockets
+    global _analyze_pool
+    if _analyze_pool is None:
+        _analyze_pool = ProcessPoolExecutor(
+            max_workers=INGEST_ANALYZE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _analyze_pool
+
+
+def _put(key, content, content_type):
+    if isinstance(content, str):
+        # a file on disk: streamed up (multipart when large)
+        s3_client.upload_file(
+            content, AWS_BUCKET, key, ExtraArgs={"ContentType": content_type}
+        )
+        return
+    s3_client.put_object(
+        Bucket=AWS_BUCKET, Key=key, Body=content, ContentType=content_type
+    )
+
+
+def _write_rows(album_id, stored):
+    """Upsert file_metadata for every stored image in one round of bulk
+    statements. A re-uploaded filename UPDATES its existing row (and drops
+    its old face data so it re-detects clean); the bumped upload_date also
+    versions the image URL so browsers fetch the new file. Runs on a worker
+    thread in its own session — never the request's. Returns
+    {filename: file_metadata.id}."""
+    now = datetime.now()
+    with session_scope() as session:
+        existing = dict(
+            session.execute(
+                select(FileMetadata.filename, FileMetadata.id).where(
+                    FileMetadata.album_id == album_id,
+                    FileMetadata.filename.in_(list(stored)),
+                )
+            ).all()
+        )
+        updates, inserts = [], []
+        for filename, fields in stored.items():
+            # no EXIF date -> the upload time, same rule the 0016 backfill used
+            row = {
+                **fields,
+                "upload_date": now,
+                "captured_at": fields["captured_at"] or now,
+            }
+            if filename in existing:
+                updates.append({"id": existing[filename], **row})
+            else:
+                inserts.append({"album_id": album_id, "filename": filename, **row})
+
+        ids = dict(existing)
+        if updates:
+            changed = [u["id"] for u in updates]
+            session.query(PhotoFaceLink).filter(
+                PhotoFaceLink.photo_id.in_(changed)
+            ).delete(synchronize_session=False)
+            session.query(FaceEmbedding).filter(
+                FaceEmbedding.photo_id.in_(changed)
+            ).delete(synchronize_session=False)
+            session.execute(update(FileMetadata), updates)
+        if inserts:
+            ids.update(
+                session.execute(
+                    insert(FileMetadata).returning(FileMetadata.filename, FileMetadata.id),
+                    inserts,
+                ).all()
+            )
+        session.commit()
+        return ids
+
+
+async def ingest_images(items, album, on_progress=None):
+    """Store every image in `items` — (filename, content_type, read) where
+    read() returns the encoded bytes, or the path of a temp file holding them
+    that's deleted once stored (called off the event loop). Awaits
+    `on_progress(done, total)` as each file lands. Returns [(s3_key,
+    file_metadata.id)] for the files that were stored; a file whose upload or
+    analysis fails is logged and left out."""
+    total = len(items)
+    loop = asyncio.get_running_loop()
+    gate = asyncio.Semaphore(INGEST_CONCURRENCY)
+    stored = {}  # filename -> file_metadata fields
+    done = 0
+
+    async def one(filename, content_type, read):
+        nonlocal done
+        key = f"{album.slug}/{filename}"
+        async with gate:
+            content = None
+            try:
+                content = await asyncio.to_thread(read)
+                _, fields = await asyncio.gather(
+                    loop.run_in_executor(_s3_pool, _put, key, content, content_type),
+                    loop.run_in_executor(_analyzer(), inspect_image, content),
+                )
+                stored[filename] = {"content_type": content_type, **fields}
+            except Exception as e:
+                print(f"ingest failed for {key}: {e}")
+            finally:
+                if isinstance(content, str):
+                    os.unlink(content)
+        done += 1
+        if on_progress:
+            await on_progress(done, total)
+
+    await asyncio.gather(*(one(*item) for item in items))
+    if not stored:
+        return []
+    ids = await asyncio.to_thread(_write_rows, album.id, stored)
+    return [(f"{album.slug}/{filename}", ids[filename]) for filename in stored]
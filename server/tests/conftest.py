@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app imports modules relative to server/ (e.g. `from services import cache`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,215 @@
+"""services.cache against local fakes: a dict backend with Redis-like
+expiry and the in-process LRU, both on a fake clock, swapped in through
+cache.configure()."""
+
+import asyncio
+
+import pytest
+
+from services import cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeBackend:
+    """What RedisBackend does, in a dict: entries expire after their TTL,
+    counters never do."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.items = {}
+        self.ints = {}
+
+    def get(self, key):
+        data, expires = self.items.get(key, (None, 0))
+        if data is None or self.clock() >= expires:
+            self.items.pop(key, None)
+            return None
+        return data
+
+    def set(self, key, data, ttl):
+        self.items[key] = (data, self.clock() + ttl)
+
+    def delete(self, key):
+        self.items.pop(key, None)
+
+    def counters(self, keys):
+        return [self.ints.get(k, 0) for k in keys]
+
+    def incr(self, key):
+        self.ints[key] = self.ints.get(key, 0) + 1
+        return self.ints[key]
+
+    def stats(self):
+        return {"backend": "fake", "entries": len(self.items)}
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def use_backend():
+    previous = cache._backend
+
+    def use(backend):
+        cache.configure(backend)
+        return backend
+
+    yield use
+    cache.configure(previous)
+
+
+@pytest.fixture
+def fake(clock, use_backend):
+    return use_backend(FakeBackend(clock))
+
+
+def test_memory_backend_evicts_least_recently_used_by_bytes(clock):
+    backend = cache.MemoryBackend(max_bytes=250, timer=clock)
+    backend.set("a", b"a" * 100, 60)
+    backend.set("b", b"b" * 100, 60)
+    backend.get("a")  # a is now the most recently used
+    backend.set("c", b"c" * 100, 60)
+
+    assert backend.get("b") is None
+    assert backend.get("a") == b"a" * 100
+    assert backend.get("c") == b"c" * 100
+    assert backend.stats()["bytes"] == 200
+
+
+def test_memory_backend_skips_values_over_the_budget(clock):
+    backend = cache.MemoryBackend(max_bytes=100, timer=clock)
+    backend.set("small", b"s" * 10, 60)
+    backend.set("huge", b"h" * 101, 60)
+
+    assert backend.get("huge") is None
+    assert backend.get("small") == b"s" * 10
+
+
+def test_namespace_on_memory_backend_evicts_oldest(clock, use_backend):
+    use_backend(cache.MemoryBackend(max_bytes=3000, timer=clock))
+    ns = cache.Namespace("evict")
+    for i in range(5):
+        ns.set(i, b"x" * 1000)
+
+    assert ns.get(0) is None
+    assert ns.get(4) == b"x" * 1000
+
+
+@pytest.mark.parametrize("make", ["memory", "fake"])
+def test_entries_expire_after_their_ttl(make, clock, use_backend):
+    if make == "memory":
+        use_backend(cache.MemoryBackend(max_bytes=1 << 20, timer=clock))
+    else:
+        use_backend(FakeBackend(clock))
+    ns = cache.Namespace("ttl", ttl=60)
+    ns.set("short", "s", ttl=10)
+    ns.set("default", "d")
+
+    clock.advance(9)
+    assert ns.get("short") == "s"
+    clock.advance(2)
+    assert ns.get("short") is None
+    assert ns.get("default") == "d"
+    clock.advance(50)
+    assert ns.get("default") is None
+
+
+def test_invalidate_drops_only_entries_with_that_tag(fake):
+    ns = cache.Namespace("tags")
+    ns.set("x", 1, tags=["album:x"])
+    ns.set("xy", 2, tags=["album:x", "album:y"])
+    ns.set("y", 3, tags=["album:y"])
+
+    ns.invalidate("album:x")
+
+    assert ns.get("x") is None
+    assert ns.get("xy") is None
+    assert ns.get("y") == 3
+
+
+def test_invalidate_reaches_other_processes_sharing_the_backend(fake):
+    worker_a = cache.Namespace("shared")
+    worker_b = cache.Namespace("shared")
+    worker_a.set("k", "v", tags=["album:x"])
+    assert worker_b.get("k") == "v"
+
+    worker_b.invalidate("album:x")
+
+    assert worker_a.get("k") is None
+
+
+def test_clear_drops_the_whole_namespace_only(fake):
+    ns = cache.Namespace("one")
+    other = cache.Namespace("two")
+    ns.set("a", 1, tags=["t"])
+    ns.set("b", 2)
+    other.set("a", 3)
+
+    ns.clear()
+
+    assert ns.get("a") is None
+    assert ns.get("b") is None
+    assert other.get("a") == 3
+
+
+def test_set_since_drops_a_build_that_raced_an_invalidation(fake):
+    ns = cache.Namespace("race")
+    since = ns.version()
+    ns.invalidate("album:x")  # a write lands while the value is being built
+
+    assert ns.set("k", "stale", since=since) == "stale"
+    assert ns.get("k") is None
+
+    since = ns.version()
+    ns.set("k", "fresh", since=since)
+    assert ns.get("k") == "fresh"
+
+
+def test_get_or_set_does_not_store_a_raced_build(fake):
+    ns = cache.Namespace("race2")
+
+    def build():
+        ns.invalidate("album:x")
+        return "built"
+
+    assert ns.get_or_set("k", build) == "built"
+    assert ns.get("k") is None
+    assert ns.get_or_set("k", lambda: "again") == "again"
+    assert ns.get("k") == "again"
+
+
+def test_cached_decorator_tags_and_counts(fake):
+    ns = cache.Namespace("deco")
+    calls = []
+
+    @ns.cached(key=lambda album_id: album_id, tags=lambda album_id: [f"album:{album_id}"])
+    def load(album_id):
+        calls.append(album_id)
+        return {"id": album_id}
+
+    @ns.cached(key=lambda album_id: f"async:{album_id}")
+    async def load_async(album_id):
+        calls.append(-album_id)
+        return album_id
+
+    assert load(1) == {"id": 1}
+    assert load(1) == {"id": 1}
+    ns.invalidate("album:1")
+    assert load(1) == {"id": 1}
+    assert asyncio.run(load_async(2)) == 2
+    assert asyncio.run(load_async(2)) == 2
+
+    assert calls == [1, 1, -2]
+    assert ns.stats()["hits"] == 2
@@ -0,0 +1,157 @@
+"""utils.face_cluster on small synthetic embedding matrices."""
+
+import numpy as np
+import pytest
+
+from utils import face_cluster
+from utils.face_cluster import (
+    chinese_whispers,
+    groups,
+    knn_graph,
+    merge_centroids,
+    unit_rows,
+)
+
+DIM = 16
+
+
+def _blobs(rng, n_blobs=5, per_blob=40, spread=0.05):
+    centers = unit_rows(rng.normal(size=(n_blobs, DIM)))
+    X = np.vstack([
+        unit_rows(c + rng.normal(scale=spread, size=(per_blob, DIM))) for c in centers
+    ])
+    truth = np.repeat(np.arange(n_blobs), per_blob)
+    return X, truth
+
+
+def _edges(indptr, indices, weights):
+    """The CSR graph as a sorted list of (node, neighbour, rounded weight)."""
+    out = []
+    for i in range(len(indptr) - 1):
+        for p in range(indptr[i], indptr[i + 1]):
+            out.append((i, int(indices[p]), round(float(weights[p]), 5)))
+    return sorted(out)
+
+
+def _brute_force_edges(X, k, sim_min):
+    sims = X @ X.T
+    out = []
+    for i in range(len(X)):
+        others = [j for j in np.argsort(-sims[i]) if j != i][:k]
+        for j in others:
+            if sims[i, j] >= sim_min:
+                w = round(float(sims[i, j]), 5)
+                out += [(i, int(j), w), (int(j), i, w)]
+    return sorted(out)
+
+
+@pytest.mark.parametrize("k", [3, 11, 50])  # argpartition, full sort, k > n
+@pytest.mark.parametrize("block_bytes", [16, 64 * 1024 * 1024])
+def test_knn_graph_matches_brute_force(monkeypatch, k, block_bytes):
+    monkeypatch.setattr(face_cluster, "BLOCK_BYTES", block_bytes)
+    X = unit_rows(np.random.default_rng(0).normal(size=(12, DIM)))
+
+    indptr, indices, weights = knn_graph(X, k, sim_min=0.1)
+
+    assert len(indptr) == len(X) + 1
+    assert indptr[-1] == len(indices) == len(weights)
+    assert _edges(indptr, indices, weights) == _brute_force_edges(X, k, 0.1)
+
+
+def test_knn_graph_of_one_face_has_no_edges():
+    indptr, indices, _ = knn_graph(unit_rows(np.ones((1, DIM))), 5, 0.5)
+    assert list(indptr) == [0, 0]
+    assert len(indices) == 0
+
+
+def test_separated_blobs_get_one_label_each():
+    X, truth = _blobs(np.random.default_rng(1))
+
+    labels = chinese_whispers(*knn_graph(X, 20, sim_min=0.55))
+
+    per_blob = [set(labels[truth == b]) for b in range(truth.max() + 1)]
+    assert all(len(s) == 1 for s in per_blob)
+    assert len(set().union(*per_blob)) == len(per_blob)
+    assert sorted(len(g) for g in groups(labels)) == [40] * 5
+
+
+def test_small_graphs_survive_empty_vote_chunks():
+    # 3 active nodes split into >= 32 chunks: most chunks are empty
+    X = unit_rows(np.array([[1, 0], [1, 0.05], [1, -0.05], [0, 1]], dtype=np.float32))
+
+    labels = chinese_whispers(*knn_graph(X, 2, sim_min=0.9))
+
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == 3  # no edges: keeps its own label
+
+
+def test_no_edges_leaves_every_node_alone():
+    labels = chinese_whispers(np.zeros(4, dtype=np.int64), np.zeros(0, np.int64), np.zeros(0))
+    assert list(labels) == [0, 1, 2]
+
+
+def test_fixed_seed_is_reproducible():
+    # overlapping blobs, so the vote order actually matters
+    X, _ = _blobs(np.random.default_rng(2), n_blobs=6, per_blob=30, spread=0.35)
+    graph = knn_graph(X, 10, sim_min=0.3)
+
+    runs = [chinese_whispers(*graph) for _ in range(3)]
+
+    assert all(np.array_equal(runs[0], r) for r in runs[1:])
+
+
+def test_merge_centroids_joins_close_labels_only():
+    rng = np.random.default_rng(3)
+    X, truth = _blobs(rng, n_blobs=2, per_blob=20)
+    # split blob 0 in two labels (a pose split); blob 1 keeps its own
+    labels = np.where(truth == 0, np.arange(len(truth)) % 2, 7)
+
+    merged = merge_centroids(X, labels, max_dist=0.2)
+
+    assert len(set(merged[truth == 0])) == 1
+    assert set(merged[truth == 1]) == {7}
+    assert merged[0] != 7
+
+
+def test_merge_centroids_keeps_distant_labels_apart():
+    X, truth = _blobs(np.random.default_rng(4), n_blobs=3, per_blob=10)
+    assert np.array_equal(merge_centroids(X, truth, max_dist=0.2), truth)
+
+
+def _region_setup():
+    """Region = blob 0 (person "a"). "b" is blob 0's pose-split twin living
+    outside the region; "c" is someone else entirely."""
+    rng = np.random.default_rng(5)
+    X, truth = _blobs(rng, n_blobs=2, per_blob=10)
+    clusters = [np.flatnonzero(truth == 0)]
+    twin = unit_rows(X[truth == 0].sum(axis=0) + rng.normal(scale=0.02, size=DIM))[0]
+    stranger = unit_rows(X[truth == 1].sum(axis=0))[0]
+    ids = ["a", "b", "c"]
+    centroids = np.vstack([unit_rows(X[truth == 0].sum(axis=0)), twin, stranger])
+    return X, clusters, ids, centroids
+
+
+def test_expand_region_pulls_in_close_outside_people_only():
+    X, clusters, ids, centroids = _region_setup()
+
+    grown = face_cluster.expand_region(X, clusters, ids, centroids, {"a"}, 0.2)
+
+    assert grown == {"a", "b"}
+
+
+def test_expand_region_never_drops_anyone_already_in_it():
+    X, clusters, ids, centroids = _region_setup()
+    region = {"a", "gone"}  # "gone" has no centroid any more (all faces deleted)
+
+    grown = face_cluster.expand_region(X, clusters, ids, centroids, region, 0.2)
+
+    assert region <= grown
+    assert "c" not in grown
+
+
+def test_expand_region_is_a_fixed_point_once_nothing_is_near():
+    X, clusters, ids, centroids = _region_setup()
+    region = face_cluster.expand_region(X, clusters, ids, centroids, {"a"}, 0.2)
+
+    assert face_cluster.expand_region(X, clusters, ids, centroids, region, 0.2) == region
+    assert face_cluster.expand_region(X, [], ids, centroids, {"a"}, 0.2) == {"a"}
@@ -0,0 +1,123 @@
+"""PersonMatcher against a brute-force stand-in for the pgvector query it
+replaced (face_recog._match_person: the nearest tagged face, a match within
+MATCH_DIST), on a small toy embedding matrix."""
+
+import numpy as np
+
+from utils.face_cluster import unit_rows
+from utils.face_matcher import PersonMatcher, UNSURE
+
+DIM = 8
+MATCH_DIST = 0.44
+UNSURE_DIST = 0.60
+
+
+class FakeSession:
+    """Answers PersonMatcher.load's one query: (face_id, embedding) rows
+    ordered by face_id, id."""
+
+    def __init__(self, faces):
+        self.faces = sorted(faces, key=lambda f: f[0])
+
+    def execute(self, _stmt):
+        return self
+
+    def all(self):
+        return list(self.faces)
+
+
+def _pgvector_match(faces, embedding):
+    """What _match_person's ORDER BY embedding <=> :e LIMIT 1 returns."""
+    q = unit_rows(embedding)[0]
+    best, best_dist = None, None
+    for face_id, emb in faces:
+        d = 1.0 - float(unit_rows(emb)[0] @ q)
+        if best_dist is None or d < best_dist:
+            best, best_dist = face_id, d
+    return best if best_dist is not None and best_dist <= MATCH_DIST else None
+
+
+def _people(rng, n_people=4, per_person=6, spread=0.08):
+    """Tight clusters around random, well-separated identity directions."""
+    centers = unit_rows(rng.normal(size=(n_people, DIM)))
+    faces = []
+    for p, c in enumerate(centers):
+        for _ in range(per_person):
+            faces.append((f"p{p}", unit_rows(c + rng.normal(scale=spread, size=DIM))[0]))
+    return centers, faces
+
+
+def _matcher(faces, exemplars):
+    m = PersonMatcher(exemplars=exemplars, dim=DIM)
+    m.load(FakeSession(faces))
+    return m
+
+
+def _resolved(matcher, faces, queries):
+    # as face_recog._match_people does: UNSURE falls back to pgvector
+    return [
+        _pgvector_match(faces, q) if r is UNSURE else r
+        for r, q in zip(matcher.match(None, queries, MATCH_DIST, UNSURE_DIST), queries)
+    ]
+
+
+def _queries(rng, centers):
+    near = [unit_rows(c + rng.normal(scale=0.05, size=DIM))[0] for c in centers]
+    far = list(unit_rows(rng.normal(size=(20, DIM))))
+    return near + far
+
+
+def test_agrees_with_pgvector_when_every_face_is_kept():
+    rng = np.random.default_rng(0)
+    centers, faces = _people(rng)
+    matcher = _matcher(faces, exemplars=32)
+    queries = _queries(rng, centers)
+
+    got = matcher.match(None, queries, MATCH_DIST, UNSURE_DIST)
+
+    assert UNSURE not in got
+    assert got == [_pgvector_match(faces, q) for q in queries]
+    assert got[: len(centers)] == [f"p{p}" for p in range(len(centers))]
+    assert None in got[len(centers):]
+
+
+def test_agrees_with_pgvector_on_a_sampled_index_after_fallback():
+    rng = np.random.default_rng(1)
+    centers, faces = _people(rng, per_person=10)
+    matcher = _matcher(faces, exemplars=3)  # lossy: most faces not kept
+    queries = _queries(rng, centers) + [emb for _, emb in faces]
+
+    assert _resolved(matcher, faces, queries) == [
+        _pgvector_match(faces, q) for q in queries
+    ]
+
+
+def test_a_centroid_alone_never_tags_a_face():
+    # two faces 120 degrees apart: their centroid sits between them, 60
+    # degrees (cosine distance 0.5) from each — pgvector finds no match
+    a = np.zeros(DIM, dtype=np.float32)
+    b = np.zeros(DIM, dtype=np.float32)
+    a[0], b[0], b[1] = 1.0, np.cos(2 * np.pi / 3), np.sin(2 * np.pi / 3)
+    faces = [("p", a), ("p", b)]
+    query = unit_rows(a + b)[0]
+    assert _pgvector_match(faces, query) is None
+
+    assert _matcher(faces, exemplars=32).match(
+        None, [query], MATCH_DIST, UNSURE_DIST
+    ) == [None]
+    # when the index is sampled the centroid only raises a doubt
+    assert _matcher(faces, exemplars=1).match(
+        None, [query], MATCH_DIST, UNSURE_DIST
+    ) == [UNSURE]
+
+
+def test_added_faces_are_matched_afterwards():
+    rng = np.random.default_rng(2)
+    centers, faces = _people(rng, n_people=2)
+    matcher = _matcher(faces, exemplars=32)
+    newcomer = unit_rows(rng.normal(size=DIM))[0]
+    assert matcher.match(None, [newcomer], MATCH_DIST, UNSURE_DIST) == [None]
+
+    matcher.add("new", newcomer)
+
+    assert matcher.match(None, [newcomer], MATCH_DIST, UNSURE_DIST) == ["new"]
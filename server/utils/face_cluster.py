@@ -0,0 +1,189 @@
+"""Array-backed clustering engine behind recluster_faces.
+
+Everything runs on one (n, 512) float32 matrix of L2-normalized embeddings:
+
+  knn_graph        exact kNN by blocked matrix multiplies (bounded memory),
+                   thresholded and stored as a CSR adjacency
+  chinese_whispers label propagation over the CSR arrays
+  merge_centroids  stage-2 union of clusters whose centroids nearly coincide
+  expand_region    which outside people an incremental recluster must pull in
+
+Working memory is capped by FACE_CLUSTER_BLOCK_MB per similarity block, so a
+100k-face library reclusters in seconds without materializing an n x n matrix.
+"""
+
+import os
+
+import numpy as np
+
+BLOCK_BYTES = int(os.environ.get("FACE_CLUSTER_BLOCK_MB", "64")) * 1024 * 1024
+# nodes voting at once per label-propagation step; small enough that it
+# behaves like the classic one-node-at-a-time sweep
+CW_CHUNK = int(os.environ.get("FACE_CLUSTER_CW_CHUNK", "2048"))
+
+
+def unit_rows(m):
+    m = np.asarray(m, dtype=np.float32)
+    if m.ndim == 1:
+        m = m[None, :]
+    n = np.linalg.norm(m, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return m / n
+
+
+def _block_rows(n):
+    return max(1, BLOCK_BYTES // max(1, n * 4))
+
+
+def knn_graph(X, k, sim_min):
+    """Each face's k nearest neighbours with cosine similarity >= sim_min, as a
+    symmetric CSR graph (indptr, indices, weights). Like the old HNSW query,
+    an edge found from both ends is kept twice, weighting mutual neighbours
+    double in the vote."""
+    n = len(X)
+    src, dst, sim = [], [], []
+    if n > 1:
+        kk = min(k, n - 1)
+        step = _block_rows(n)
+        for start in range(0, n, step):
+            block = X[start:start + step] @ X.T
+            rows = np.arange(len(block))
+            block[rows, rows + start] = -np.inf  # never your own neighbour
+            if kk < n - 1:
+                nn = np.argpartition(-block, kk - 1, axis=1)[:, :kk]
+            else:
+                nn = np.argsort(-block, axis=1)[:, :kk]
+            s = np.take_along_axis(block, nn, axis=1)
+            keep = s >= sim_min
+            src.append(np.repeat(rows + start, keep.sum(axis=1)))
+            dst.append(nn[keep])
+            sim.append(s[keep])
+    src = np.concatenate(src) if src else np.zeros(0, dtype=np.int64)
+    dst = np.concatenate(dst) if dst else np.zeros(0, dtype=np.int64)
+    sim = np.concatenate(sim).astype(np.float32) if sim else np.zeros(0, np.float32)
+
+    a = np.concatenate([src, dst])
+    b = np.concatenate([dst, src])
+    w = np.concatenate([sim, sim])
+    order = np.argsort(a, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(a, minlength=n), out=indptr[1:])
+    return indptr, b[order], w[order]
+
+
+def _vote(nodes, indptr, indices, weights, labels):
+    """Winning label for each node: the neighbour label with the highest summed
+    edge weight (ties -> smallest label, so runs are reproducible). Every
+    node passed in must have at least one edge."""
+    starts = indptr[nodes]
+    deg = indptr[nodes + 1] - starts
+    local = np.repeat(np.arange(len(nodes)), deg)
+    pos = np.repeat(starts - (np.cumsum(deg) - deg), deg) + np.arange(deg.sum())
+    nb = labels[indices[pos]]
+    w = weights[pos]
+
+    order = np.lexsort((nb, local))
+    local, nb, w = local[order], nb[order], w[order]
+    brk = np.flatnonzero(np.r_[True, (local[1:] != local[:-1]) | (nb[1:] != nb[:-1])])
+    sums = np.add.reduceat(w, brk)
+    node_of, label_of = local[brk], nb[brk]
+
+    order = np.lexsort((-sums, node_of))
+    node_of, label_of = node_of[order], label_of[order]
+    first = np.flatnonzero(np.r_[True, node_of[1:] != node_of[:-1]])
+    return label_of[first]
+
+
+def chinese_whispers(indptr, indices, weights, iterations=25, seed=1):
+    """Graph clustering by iterative majority vote (Fei 2007), over CSR arrays.
+    Each pass visits nodes in a shuffled order in small chunks that vote
+    together. Robust to single-link chaining because one weak edge can't
+    outvote a real cluster. Returns a label per node."""
+    n = len(indptr) - 1
+    labels = np.arange(n)
+    active = np.flatnonzero(np.diff(indptr) > 0)
+    if not len(active):
+        return labels
+    rng = np.random.default_rng(seed)  # fixed seed -> reproducible reclusters
+    chunks = max(1, -(-len(active) // CW_CHUNK))
+    for _ in range(iterations):
+        changed = 0
+        for nodes in np.array_split(rng.permutation(active), max(chunks, 32)):
+            if not len(nodes):
+                continue
+            best = _vote(nodes, indptr, indices, weights, labels)
+            changed += int((labels[nodes] != best).sum())
+            labels[nodes] = best
+        if changed == 0:
+            break
+    return labels
+
+
+def _components(n, a, b):
+    """Connected components over edge list (a, b): min-label hooking plus
+    pointer jumping, all in array ops. Returns a root id per node."""
+    comp = np.arange(n)
+    while True:
+        ra, rb = comp[a], comp[b]
+        low = np.minimum(ra, rb)
+        new = comp.copy()
+        np.minimum.at(new, ra, low)
+        np.minimum.at(new, rb, low)
+        while True:
+            jumped = new[new]
+            if np.array_equal(jumped, new):
+                break
+            new = jumped
+        if np.array_equal(new, comp):
+            return comp
+        comp = new
+
+
+def merge_centroids(X, labels, max_dist):
+    """Stage 2: union clusters whose averaged identity vectors sit within
+    max_dist (cosine) of each other — reunites pose-split people. Returns new
+    labels; members of merged clusters share one."""
+    uniq, inv = np.unique(labels, return_inverse=True)
+    g = len(uniq)
+    if g < 2:
+        return labels
+    order = np.argsort(inv, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(inv[order]) != 0])
+    cent = unit_rows(np.add.reduceat(X[order], starts, axis=0))
+
+    thr = 1.0 - max_dist
+    a, b = [], []
+    step = _block_rows(g)
+    for start in range(0, g, step):
+        i, j = np.nonzero(cent[start:start + step] @ cent.T >= thr)
+        i += start
+        keep = j > i
+        a.append(i[keep])
+        b.append(j[keep])
+    a, b = np.concatenate(a), np.concatenate(b)
+    if not len(a):
+        return labels
+    return uniq[_components(g, a, b)][inv]
+
+
+def expand_region(X, clusters, ids, centroids, region, max_dist):
+    """One growth step of an incremental recluster. `clusters` are row
+    indices into X for the region's clusters; `ids` / `centroids` are every
+    person's external id and unit centroid. Returns the region plus each
+    person outside it whose centroid lies within max_dist of a region
+    cluster's — a set that only ever grows, so nobody outside the final
+    region is touched."""
+    region = set(region)
+    outside = np.array([pid not in region for pid in ids], dtype=bool)
+    if not len(clusters) or not outside.any():
+        return region
+    reps = unit_rows([X[m].sum(axis=0) for m in clusters])
+    near = (reps @ centroids[outside].T >= 1.0 - max_dist).any(axis=0)
+    return region | set(np.array(ids, dtype=object)[outside][near])
+
+
+def groups(labels):
+    """Row indices per label, as a list of arrays."""
+    order = np.argsort(labels, kind="stable")
+    cuts = np.flatnonzero(np.diff(labels[order]) != 0) + 1
+    return np.split(order, cuts)
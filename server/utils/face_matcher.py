@@ -0,0 +1,195 @@
+"""In-process nearest-person index for the live (incremental) face tagger.
+
+Every person is held as a handful of exemplar embeddings plus their running
+centroid, stacked into one float32 matrix. Matching a photo's faces is then a
+single matrix product instead of one pgvector ORDER BY ... LIMIT 1 per face.
+
+Postgres stays the source of truth: the index is rebuilt from face_embedding
+after recluster_faces, grows as faces are tagged, and is simply dropped
+(lazily reloaded) whenever identities change underneath it — merges, album
+deletes, resyncs. People with more faces than FACE_MATCHER_EXEMPLARS keep a
+strided sample, so a near miss against such a person is reported as UNSURE
+and the caller confirms it with the exact pgvector query.
+
+How this differs from the pgvector query it replaced (_match_person: the
+single nearest tagged face, a match within MATCH_DIST):
+
+  - a hit always means a real (kept) face within match_dist — the centroid
+    rows alone never tag a face, they can only make it UNSURE;
+  - while every person fits in FACE_MATCHER_EXEMPLARS the answer is exact;
+  - past that, a face whose nearest neighbour is one we didn't keep is only
+    caught if some kept face or the centroid is within unsure_dist. One
+    further out is a miss here where pgvector would have matched, and a hit
+    can name a different person than pgvector when an unkept face of
+    someone else is nearer still.
+"""
+
+import os
+import threading
+
+import numpy as np
+from sqlalchemy import select
+
+from db.models import FaceEmbedding
+from utils.face_cluster import unit_rows
+
+# exemplars kept per person (plus the centroid row)
+MATCHER_EXEMPLARS = int(os.environ.get("FACE_MATCHER_EXEMPLARS", "32"))
+
+# "ask Postgres" marker for a near miss the sampled index can't rule out
+UNSURE = object()
+
+
+class PersonMatcher:
+    def __init__(self, exemplars=MATCHER_EXEMPLARS, dim=512):
+        self._lock = threading.Lock()
+        self._exemplars = exemplars
+        self._dim = dim
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._people = []           # person index -> external_id
+        self._index = {}            # external_id -> person index
+        self._sums = np.zeros((0, self._dim), dtype=np.float32)
+        self._kept = np.zeros(0, dtype=np.int32)      # exemplars held per person
+        self._centroid_row = np.zeros(0, dtype=np.int64)
+        self._rows = np.zeros((64, self._dim), dtype=np.float32)
+        self._owner = np.zeros(64, dtype=np.int64)    # row -> person index
+        self._is_centroid = np.zeros(64, dtype=bool)
+        self._size = 0
+        self._lossy = False         # some person has more faces than we kept
+
+    # -- storage -------------------------------------------------------------
+
+    def _append_rows(self, vecs, owners, centroid=False):
+        need = self._size + len(vecs)
+        if need > len(self._rows):
+            cap = max(need, len(self._rows) * 2)
+            rows = np.zeros((cap, self._dim), dtype=np.float32)
+            rows[: self._size] = self._rows[: self._size]
+            owner = np.zeros(cap, dtype=np.int64)
+            owner[: self._size] = self._owner[: self._size]
+            is_centroid = np.zeros(cap, dtype=bool)
+            is_centroid[: self._size] = self._is_centroid[: self._size]
+            self._rows, self._owner = rows, owner
+            self._is_centroid = is_centroid
+        start = self._size
+        self._rows[start:need] = vecs
+        self._owner[start:need] = owners
+        self._is_centroid[start:need] = centroid
+        self._size = need
+        return np.arange(start, need)
+
+    def _new_people(self, ids, sums):
+        base = len(self._people)
+        self._people.extend(ids)
+        for i, pid in enumerate(ids):
+            self._index[pid] = base + i
+        self._sums = np.vstack([self._sums, sums])
+        self._kept = np.concatenate([self._kept, np.zeros(len(ids), dtype=np.int32)])
+        rows = self._append_rows(
+            unit_rows(sums), np.arange(base, base + len(ids)), centroid=True
+        )
+        self._centroid_row = np.concatenate([self._centroid_row, rows])
+
+    # -- building --------------------------------------------------------------
+
+    def load(self, session):
+        """(Re)build from every assigned embedding in one columnar read."""
+        rows = session.execute(
+            select(FaceEmbedding.face_id, FaceEmbedding.embedding)
+            .where(FaceEmbedding.face_id.isnot(None))
+            .order_by(FaceEmbedding.face_id, FaceEmbedding.id)
+        ).all()
+        with self._lock:
+            self._reset()
+            if rows:
+                ids = np.array([r[0] for r in rows], dtype=object)
+                emb = unit_rows([r[1] for r in rows])
+                starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+                counts = np.diff(np.r_[starts, len(ids)])
+                self._new_people(list(ids[starts]), np.add.reduceat(emb, starts, axis=0))
+                # strided exemplar sample per person, spread over their faces
+                picks = []
+                for p, (s, c) in enumerate(zip(starts, counts)):
+                    step = max(1, -(-c // self._exemplars))
+                    sel = np.arange(s, s + c, step)[: self._exemplars]
+                    picks.append(sel)
+                    self._kept[p] = len(sel)
+                picks = np.concatenate(picks)
+                owners = np.repeat(np.arange(len(starts)), self._kept)
+                self._append_rows(emb[picks], owners)
+                self._lossy = bool((counts > self._kept).any())
+            self._loaded = True
+
+    def invalidate(self):
+        """Identities changed under us — reload from Postgres on next use."""
+        with self._lock:
+            self._reset()
+
+    def add(self, face_id, embedding):
+        """Record a newly tagged face: updates the person's centroid and keeps
+        it as an exemplar while the person has room. No-op until loaded."""
+        vec = unit_rows(embedding)
+        with self._lock:
+            if not self._loaded:
+                return
+            p = self._index.get(face_id)
+            if p is None:
+                self._new_people([face_id], vec)
+                p = self._index[face_id]
+            else:
+                self._sums[p] += vec[0]
+                self._rows[self._centroid_row[p]] = unit_rows(self._sums[p])[0]
+            if self._kept[p] < self._exemplars:
+                self._append_rows(vec, [p])
+                self._kept[p] += 1
+            else:
+                self._lossy = True
+
+    # -- querying --------------------------------------------------------------
+
+    def centroids(self, session):
+        """(external_ids, unit centroid matrix) for every person, in the same
+        order. Used by the incremental recluster to spot merge candidates."""
+        if not self._loaded:
+            self.load(session)
+        with self._lock:
+            return list(self._people), self._rows[self._centroid_row].copy()
+
+    def match(self, session, embeddings, match_dist, unsure_dist):
+        """Nearest person for each embedding, in one matrix product. Returns a
+        list of external_id (a kept face within match_dist), None (nobody
+        close), or UNSURE (a near miss within unsure_dist — of a kept face or
+        a centroid — that only a face we didn't keep could turn into a
+        match)."""
+        if not len(embeddings):
+            return []
+        if not self._loaded:
+            self.load(session)
+        q = unit_rows(embeddings)
+        with self._lock:
+            if not self._size:
+                return [None] * len(q)
+            sims = q @ self._rows[: self._size].T
+            nearest = 1.0 - sims.max(axis=1)
+            # only real faces can make a match
+            sims[:, self._is_centroid[: self._size]] = -np.inf
+            best = sims.argmax(axis=1)
+            dist = 1.0 - sims[np.arange(len(q)), best]
+            owners = self._owner[best]
+            people, lossy = self._people, self._lossy
+        out = []
+        for d, near, p in zip(dist, nearest, owners):
+            if d <= match_dist:
+                out.append(people[p])
+            elif lossy and near <= unsure_dist:
+                out.append(UNSURE)
+            else:
+                out.append(None)
+        return out
+
+
+# one per process — the API runs a single replica, like upload_jobs
+matcher = PersonMatcher()
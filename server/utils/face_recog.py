@@ -1,23 +1,28 @@
+import base64
+import hashlib
 import io
 import os
-import random
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
 import requests
-from PIL import Image
-from sqlalchemy import text
+from sqlalchemy import bindparam, insert, select, text, update
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from config import settings
 from services.aws_service import s3_client
 from db.base import session_scope
 from db.models import FaceData, FaceEmbedding, PhotoFaceLink, FileMetadata, Album
+from utils import face_cluster
+from utils.face_matcher import matcher, UNSURE
+from utils.image_utils import ImageLRU, image_nbytes, load_image
 
 AWS_BUCKET = settings.AWS_BUCKET
 
 # InsightFace embedding service (GPU pod on max). Internal cluster DNS.
 FACE_SERVICE_URL = os.environ.get("FACE_SERVICE_URL", "http://photoaura-faces:8000")
+# photos per /embed/batch call — one round-trip, GPU micro-batched server-side
+FACE_EMBED_BATCH = int(os.environ.get("FACE_EMBED_BATCH", "16"))
 
 # cosine distance (1 - similarity) on L2-normalized ArcFace vectors.
 # <= MATCH_DIST -> same person; the band up to SUGGEST_DIST is "maybe same".
@@ -70,6 +75,14 @@ CHIP_PITCH_MAX = float(os.environ.get("FACE_PITCH_MAX", "24"))
 CHIP_MIN_PX = int(os.environ.get("FACE_MIN_PX", "90"))
 CHIP_SHARP_MIN = float(os.environ.get("FACE_SHARP_MIN", "120"))
 
+# chip stage after a recluster: crops/uploads in flight, and how much decoded
+# source imagery to keep around for photos that supply several chips
+CHIP_WORKERS = int(os.environ.get("FACE_CHIP_WORKERS", "8"))
+CHIP_LRU_MB = int(os.environ.get("FACE_CHIP_LRU_MB", "256"))
+# sources are decoded at the smallest JPEG scale that keeps every face crop
+# at least this many pixels on its short side (never upscaled)
+CHIP_PX = int(os.environ.get("FACE_CHIP_PX", "320"))
+
 # key_score sentinel for a manually pinned cover. Far above any auto face_score
 # (~195 max), so neither incremental tagging nor recluster ever overwrites it.
 COVER_LOCK = 1_000_000.0
@@ -79,13 +92,35 @@ def _embed_image(bucket, key):
     """Ask the GPU service for every face's bbox + 512-d embedding."""
     resp = requests.post(
         f"{FACE_SERVICE_URL}/embed",
-        json={"bucket": bucket, "key": key},
+        json={"bucket": bucket, "key": key, "chip_min_px": CHIP_MIN_PX},
         timeout=120,
     )
     resp.raise_for_status()
     return resp.json()
 
 
+def embed_images(bucket, keys):
+    """Embed many photos in one service call. Returns {key: result} in the
+    /embed response shape; keys the service couldn't fetch or decode are left
+    out, so detect_and_store_faces falls back to a single /embed for them."""
+    if not keys:
+        return {}
+    resp = requests.post(
+        f"{FACE_SERVICE_URL}/embed/batch",
+        json={"bucket": bucket, "keys": list(keys), "chip_min_px": CHIP_MIN_PX},
+        timeout=120 + 15 * len(keys),
+    )
+    resp.raise_for_status()
+    out = {}
+    for r in resp.json().get("results", []):
+        if not r or r.get("error"):
+            if r:
+                print(f"embed batch: {r['key']}: {r['error']}")
+            continue
+        out[r["key"]] = r
+    return out
+
+
 def _min_px(face):
     x1, y1, x2, y2 = face["bbox"]
     return min(x2 - x1, y2 - y1)
@@ -163,8 +198,25 @@ def _match_person(session, embedding):
     return None
 
 
-def _crop(img, bbox, pad=0.2):
-    x1, y1, x2, y2 = bbox
+def _match_people(session, embeddings):
+    """_match_person for many faces at once: one dot product against the
+    in-memory person index, falling back to pgvector only for near misses the
+    index can't decide (or if it fails to load)."""
+    try:
+        matches = matcher.match(session, embeddings, MATCH_DIST, SUGGEST_DIST)
+    except Exception as e:
+        print(f"face matcher unavailable, using pgvector: {e}")
+        matches = [UNSURE] * len(embeddings)
+    return [
+        _match_person(session, emb) if m is UNSURE else m
+        for m, emb in zip(matches, embeddings)
+    ]
+
+
+def _crop(img, bbox, pad=0.2, scale=1.0):
+    """Padded face crop. `bbox` is in full-resolution coordinates; `scale` is
+    the decode scale of `img` (from load_image)."""
+    x1, y1, x2, y2 = (v * scale for v in bbox)
     w, h = x2 - x1, y2 - y1
     left = max(0, int(x1 - w * pad))
     top = max(0, int(y1 - h * pad))
@@ -173,6 +225,47 @@ def _crop(img, bbox, pad=0.2):
     return img.crop((left, top, right, bottom))
 
 
+_chip_sources = ImageLRU(CHIP_LRU_MB * 1024 * 1024, sizeof=lambda v: image_nbytes(v[0]))
+
+
+def _chip_scale(bboxes):
+    """Decode scale that keeps the smallest of these face boxes >= CHIP_PX."""
+    side = min(min(b[2] - b[0], b[3] - b[1]) for b in bboxes)
+    return min(1.0, CHIP_PX / side) if side > 0 else 1.0
+
+
+def _chip_hash(key, upload_date, bbox):
+    """Fingerprint of a chip by what it's cropped from: the photo (a re-upload
+    bumps upload_date) and the face box."""
+    box = ",".join(f"{float(v):.1f}" for v in bbox)
+    stamp = upload_date.isoformat() if upload_date else ""
+    return hashlib.sha1(f"{key}|{stamp}|{box}".encode()).hexdigest()
+
+
+def _source_image(key, upload_date, scale=1.0):
+    """RGB photo for cropping, decoded at (at least) `scale` and cached per
+    photo version. Returns (image, actual_scale) for _crop."""
+    return _chip_sources.get(
+        (key, upload_date, round(scale, 3)),
+        lambda: load_image(
+            s3_client.get_object(Bucket=AWS_BUCKET, Key=key)["Body"].read(),
+            scale=scale,
+        ),
+    )
+
+
+def _set_chip_hashes(session, hashes):
+    """Record {external_id: chip_hash} in one executemany UPDATE."""
+    if not hashes:
+        return
+    session.execute(
+        update(FaceData)
+        .where(FaceData.external_id == bindparam("eid"))
+        .values(chip_hash=bindparam("hash")),
+        [{"eid": eid, "hash": h} for eid, h in hashes.items()],
+    )
+
+
 def set_person_cover(face_id, album_slug, filename):
     """Pin a person's cover chip to their face in a chosen photo. Crops that
     face, replaces faces/<face_id>.jpg, and locks key_score so auto-scoring
@@ -200,121 +293,238 @@ def set_person_cover(face_id, album_slug, filename):
             return False, "This person doesn't appear in that photo"
 
         key = f"{album_slug}/{filename}"
-        img = Image.open(
-            io.BytesIO(s3_client.get_object(Bucket=AWS_BUCKET, Key=key)["Body"].read())
-        ).convert("RGB")
+        box = fe.bbox["box"]
+        img, scale = _source_image(key, photo.upload_date, _chip_scale([box]))
         buf = io.BytesIO()
-        _crop(img, fe.bbox["box"]).save(buf, format="JPEG")
+        _crop(img, box, scale=scale).save(buf, format="JPEG")
         buf.seek(0)
         s3_client.upload_fileobj(
             buf, AWS_BUCKET, f"faces/{face_id}.jpg",
             ExtraArgs={"ContentType": "image/jpeg"},
         )
         person.key_score = COVER_LOCK
+        person.chip_hash = _chip_hash(key, photo.upload_date, box)
         session.commit()
     return True, "Cover updated"
 
 
-def detect_and_store_faces(file_path, photo_id, album_id, bucket):
-    result = _embed_image(bucket, file_path)
-    faces = result.get("faces", [])
-    if not faces:
-        return "No faces detected."
-
-    # one image fetch for the key-face crops
-    img = Image.open(
-        io.BytesIO(s3_client.get_object(Bucket=bucket, Key=file_path)["Body"].read())
-    ).convert("RGB")
-
-    with session_scope() as session:
-        for index, face in enumerate(faces):
-            ok, reason = should_index(face)
-            if not ok:
-                print(f"skip face {index + 1} in {file_path}: {reason}")
-                continue
-
-            embedding = face["embedding"]
-            match = _match_person(session, embedding)
-            chip_worthy = is_chip_worthy(face)
-
-            # a weak crop that matches nobody YET is parked unassigned (no link)
-            # rather than dropped — a person's frontal anchor may only be
-            # processed later. assign_pending_faces() claims it afterward.
-            # we still never MINT a new person from a sub-par crop (junk tiles).
-            if match is None and not chip_worthy:
-                session.add(
-                    FaceEmbedding(
-                        photo_id=photo_id,
-                        album_id=album_id,
-                        face_id=None,
-                        embedding=embedding,
-                        det_score=face.get("det_score"),
-                        bbox={"box": face["bbox"]},
-                        pose={
-                            "yaw": face.get("yaw"),
-                            "pitch": face.get("pitch"),
-                            "roll": face.get("roll"),
-                            "sharpness": face.get("sharpness"),
-                            "eye_open": face.get("eye_open"),
-                        },
-                    )
+class FaceWriter:
+    """Buffers face rows for one photo — or a whole indexing chunk — and
+    writes them in a single transaction: one bulk key_score upsert (whose
+    RETURNING says which chips won), then multi-row INSERTs for embeddings
+    and links. Faces are fed to the live matcher as they're buffered, so a
+    person minted earlier in the chunk is matched by the photos after it —
+    and, with several chunks in flight, by other writers before this one has
+    committed. So flush() makes sure a face_data row exists for every person
+    it references, not just the ones offering a key chip; otherwise a writer
+    that flushes first would break the face_id foreign keys.
+
+    A flush that fails keeps its buffer, so the caller can retry it."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._reset()
+
+    def _reset(self):
+        self.embeddings = []
+        self.links = []
+        self._linked = set()  # (photo_id, face_id) already linked
+        self.keys = {}        # face_id -> (key_score, photo_id, key, bbox, chip fn)
+
+    def add_face(self, photo_id, album_id, face, face_id=None, link=False):
+        self.embeddings.append(
+            {
+                "photo_id": photo_id,
+                "album_id": album_id,
+                "face_id": face_id,
+                "embedding": face["embedding"],
+                "det_score": face.get("det_score"),
+                "bbox": {"box": face["bbox"]},
+                "pose": {
+                    "yaw": face.get("yaw"),
+                    "pitch": face.get("pitch"),
+                    "roll": face.get("roll"),
+                    "sharpness": face.get("sharpness"),
+                    "eye_open": face.get("eye_open"),
+                },
+            }
+        )
+        if link and (photo_id, face_id) not in self._linked:
+            self._linked.add((photo_id, face_id))
+            self.links.append(
+                {"photo_id": photo_id, "face_id": face_id, "album_id": album_id}
+            )
+        if face_id:
+            matcher.add(face_id, face["embedding"])
+
+    def offer_key(self, face_id, score, photo_id, key, bbox, chip):
+        """Candidate key chip for a person, cropped at `bbox` from photo
+        `key`; the best one in the buffer goes to the upsert. `chip` (returns
+        the JPEG bytes) is only called if it wins."""
+        if face_id not in self.keys or self.keys[face_id][0] < score:
+            self.keys[face_id] = (score, photo_id, key, bbox, chip)
+
+    def flush(self):
+        if not self.embeddings:
+            self._reset()
+            return
+        try:
+            with session_scope() as session:
+                won = []
+                referenced = sorted(
+                    {e["face_id"] for e in self.embeddings if e["face_id"]}
+                    - set(self.keys)
                 )
-                session.commit()
-                continue
-            face_id = match or uuid.uuid4().hex
-
-            # only frontal/sharp crops compete to be the person's key chip;
-            # turned/soft shots still get linked, just never shown as the face
-            if chip_worthy:
-                score = face_score(face)
-                session.execute(
-                    pg_insert(FaceData)
-                    .values(external_id=face_id, key_score=score)
-                    .on_conflict_do_update(
+                if referenced:
+                    # a person another writer minted but hasn't committed yet
+                    session.execute(
+                        pg_insert(FaceData)
+                        .values([{"external_id": fid} for fid in referenced])
+                        .on_conflict_do_nothing(index_elements=["external_id"])
+                    )
+                if self.keys:
+                    dates = dict(
+                        session.query(FileMetadata.id, FileMetadata.upload_date)
+                        .filter(FileMetadata.id.in_([k[1] for k in self.keys.values()]))
+                        .all()
+                    )
+                    stmt = pg_insert(FaceData).values(
+                        [
+                            {
+                                "external_id": fid,
+                                "key_score": score,
+                                "chip_hash": _chip_hash(key, dates.get(pid), bbox),
+                            }
+                            for fid, (score, pid, key, bbox, _) in self.keys.items()
+                        ]
+                    )
+                    # DO UPDATE ... WHERE only returns rows it inserted or
+                    # raised — exactly the persons whose chip we must replace
+                    stmt = stmt.on_conflict_do_update(
                         index_elements=["external_id"],
-                        set_={"key_score": score},
+                        set_={
+                            "key_score": stmt.excluded.key_score,
+                            "chip_hash": stmt.excluded.chip_hash,
+                        },
                         where=(FaceData.key_score.is_(None))
-                        | (FaceData.key_score < score),
-                    )
+                        | (FaceData.key_score < stmt.excluded.key_score),
+                    ).returning(FaceData.external_id)
+                    won = [r[0] for r in session.execute(stmt)]
+                session.execute(insert(FaceEmbedding), self.embeddings)
+                if self.links:
+                    session.execute(insert(PhotoFaceLink), self.links)
+                session.commit()
+        except Exception:
+            # the matcher already saw these faces; let it reload from Postgres.
+            # The buffer stays so flush() can be retried.
+            matcher.invalidate()
+            raise
+
+        # committed: from here nothing may raise, or a retried flush would
+        # insert the rows twice
+        keys = self.keys
+        self._reset()
+        failed = {}
+        for face_id in won:
+            try:
+                s3_client.upload_fileobj(
+                    io.BytesIO(keys[face_id][4]()),
+                    self.bucket,
+                    f"faces/{face_id}.jpg",
+                    ExtraArgs={"ContentType": "image/jpeg"},
                 )
-                session.flush()
-
-                fd = session.query(FaceData).filter_by(external_id=face_id).first()
-                if fd and fd.key_score == score:
-                    buf = io.BytesIO()
-                    _crop(img, face["bbox"]).save(buf, format="JPEG")
-                    buf.seek(0)
-                    s3_client.upload_fileobj(
-                        buf,
-                        bucket,
-                        f"faces/{face_id}.jpg",
-                        ExtraArgs={"ContentType": "image/jpeg"},
-                    )
+            except Exception as e:
+                print(f"chip upload failed for {face_id}: {e}")
+                failed[face_id] = None  # no chip behind the hash -> recrop later
+        if failed:
+            try:
+                with session_scope() as session:
+                    _set_chip_hashes(session, failed)
+                    session.commit()
+            except Exception as e:
+                print(f"could not clear chip hashes for {list(failed)}: {e}")
+
+
+def detect_and_store_faces(
+    file_path, photo_id, album_id, bucket, result=None, writer=None
+):
+    """Index one photo's faces. Pass `result` (from embed_images) to skip the
+    per-photo /embed round-trip, and a FaceWriter to buffer the rows into the
+    caller's batch (the caller flushes); without one the photo is written in
+    a single transaction here."""
+    if result is None:
+        result = _embed_image(bucket, file_path)
+    faces = result.get("faces", [])
+    if not faces:
+        return "No faces detected."
+    img_w = result.get("img_w")
+
+    # the service crops chip candidates from the frame it already decoded;
+    # only an older service without "chip" makes us fetch the photo ourselves
+    # (once, at the scale the smallest candidate needs)
+    src = None
+
+    def _chip_bytes(face):
+        nonlocal src
+        if face.get("chip"):
+            return base64.b64decode(face["chip"])
+        if src is None:
+            src = load_image(
+                s3_client.get_object(Bucket=bucket, Key=file_path)["Body"].read(),
+                scale=_chip_scale([f["bbox"] for f in faces if not f.get("chip")]),
+            )
+        img, scale = src
+        buf = io.BytesIO()
+        _crop(img, face["bbox"], scale=scale).save(buf, format="JPEG")
+        return buf.getvalue()
+
+    indexed = []
+    for index, face in enumerate(faces):
+        ok, reason = should_index(face)
+        if not ok:
+            print(f"skip face {index + 1} in {file_path}: {reason}")
+            continue
+        indexed.append(face)
+    if not indexed:
+        return "No faces detected."
 
-            session.add(
-                FaceEmbedding(
-                    photo_id=photo_id,
-                    album_id=album_id,
-                    face_id=face_id,
-                    embedding=embedding,
-                    det_score=face.get("det_score"),
-                    bbox={"box": face["bbox"]},
-                    pose={
-                        "yaw": face.get("yaw"),
-                        "pitch": face.get("pitch"),
-                        "roll": face.get("roll"),
-                        "sharpness": face.get("sharpness"),
-                        "eye_open": face.get("eye_open"),
-                    },
-                )
+    own = writer is None
+    if own:
+        writer = FaceWriter(bucket)
+    with session_scope() as session:
+        # every face in the photo matched in one vectorized pass. A person
+        # minted for one face here isn't visible to the photo's other faces —
+        # deliberately: two faces in one frame are two different people, so
+        # matching them to each other could only ever be a false merge
+        matches = _match_people(session, [f["embedding"] for f in indexed])
+    for face, match in zip(indexed, matches):
+        chip_worthy = is_chip_worthy(face)
+
+        # a weak crop that matches nobody YET is parked unassigned (no link)
+        # rather than dropped — a person's frontal anchor may only be
+        # processed later. assign_pending_faces() claims it afterward.
+        # we still never MINT a new person from a sub-par crop (junk tiles).
+        if match is None and not chip_worthy:
+            writer.add_face(photo_id, album_id, face)
+            continue
+        face_id = match or uuid.uuid4().hex
+
+        # only frontal/sharp crops compete to be the person's key chip;
+        # turned/soft shots still get linked, just never shown as the face
+        if chip_worthy:
+            writer.offer_key(
+                face_id, face_score(face), photo_id, file_path, face["bbox"],
+                lambda f=face: _chip_bytes(f),
             )
-            # only tag the photo as this person's if the face is a real subject,
-            # not a tiny face in the background
-            if _is_prominent(face["bbox"], img.width):
-                session.add(
-                    PhotoFaceLink(photo_id=photo_id, face_id=face_id, album_id=album_id)
-                )
-            session.commit()
+
+        # only tag the photo as this person's if the face is a real subject,
+        # not a tiny face in the background
+        writer.add_face(
+            photo_id, album_id, face, face_id,
+            link=_is_prominent(face["bbox"], img_w),
+        )
+    if own:
+        writer.flush()
 
     return "Faces processed and stored."
 
@@ -324,34 +534,38 @@ def assign_pending_faces(album_id=None):
     cluster exists. Order-independent — fixes turned shots processed before
     their person's frontal anchor. Pass album_id to scope to one album."""
     with session_scope() as session:
-        q = session.query(FaceEmbedding).filter(FaceEmbedding.face_id.is_(None))
+        q = select(
+            FaceEmbedding.id,
+            FaceEmbedding.photo_id,
+            FaceEmbedding.album_id,
+            FaceEmbedding.embedding,
+        ).where(FaceEmbedding.face_id.is_(None))
         if album_id is not None:
-            q = q.filter(FaceEmbedding.album_id == album_id)
-        pending = q.all()
+            q = q.where(FaceEmbedding.album_id == album_id)
+        pending = session.execute(q).all()
 
-        claimed = 0
-        for fe in pending:
-            match = _match_person(session, fe.embedding)
+        tagged = []
+        assign, links = [], []
+        matches = _match_people(session, [fe.embedding for fe in pending])
+        for fe, match in zip(pending, matches):
             if not match:
                 continue
-            fe.face_id = match
-            session.add(
-                PhotoFaceLink(
-                    photo_id=fe.photo_id, face_id=match, album_id=fe.album_id
-                )
+            assign.append({"id": fe.id, "face_id": match})
+            links.append(
+                {"photo_id": fe.photo_id, "face_id": match, "album_id": fe.album_id}
             )
-            claimed += 1
+            tagged.append((match, fe.embedding))
+        if assign:
+            session.execute(update(FaceEmbedding), assign)
+            session.execute(insert(PhotoFaceLink), links)
         session.commit()
+        for match, emb in tagged:
+            matcher.add(match, emb)
+        claimed = len(tagged)
     print(f"assign_pending_faces: claimed {claimed}/{len(pending)} parked faces")
     return claimed
 
 
-def _unit(v):
-    v = np.asarray(v, dtype=float)
-    n = np.linalg.norm(v)
-    return v / n if n else v
-
-
 def _stored_face(fe):
     """Rebuild a face dict (for face_score / is_chip_worthy) from a stored row."""
     p = fe.pose or {}
@@ -366,44 +580,204 @@ def _stored_face(fe):
     }
 
 
-def _chinese_whispers(node_ids, adjacency, iterations=25):
-    """Graph clustering by iterative majority vote (Fei 2007). Each node adopts
-    the label with the highest summed edge weight among its neighbours. Robust
-    to single-link chaining because one weak edge can't outvote a real cluster.
-    Returns {node_id: label}."""
-    labels = {n: n for n in node_ids}
-    rng = random.Random(1)  # fixed seed -> reproducible reclusters
-    for _ in range(iterations):
-        order = list(node_ids)
-        rng.shuffle(order)
-        changed = 0
-        for n in order:
-            scores = {}
-            for nb, w in adjacency.get(n, ()):
-                lbl = labels[nb]
-                scores[lbl] = scores.get(lbl, 0.0) + w
-            if not scores:
-                continue
-            best = max(scores, key=scores.get)
-            if labels[n] != best:
-                labels[n] = best
-                changed += 1
-        if changed == 0:
-            break
-    return labels
+_FACE_COLS = (
+    FaceEmbedding.id,
+    FaceEmbedding.photo_id,
+    FaceEmbedding.album_id,
+    FaceEmbedding.face_id,
+    FaceEmbedding.det_score,
+    FaceEmbedding.bbox,
+    FaceEmbedding.pose,
+    FaceEmbedding.embedding,
+)
+
+
+def _cluster(X):
+    """Chinese Whispers over the kNN graph, then the centroid merge. Returns a
+    list of member row indices per cluster."""
+    # edges: each face's nearest neighbours within CLUSTER_DIST
+    graph = face_cluster.knn_graph(X, CLUSTER_KNN, 1.0 - CLUSTER_DIST)
+    labels = face_cluster.chinese_whispers(*graph)
+    # stage 2: centroid merge — reunite pose-split people (frontal vs profile)
+    labels = face_cluster.merge_centroids(X, labels, CENTROID_MERGE_DIST)
+    return [m.tolist() for m in face_cluster.groups(labels)]
+
+
+def _write_people(session, faces, clusters, img_w, old):
+    """Turn clusters of face rows into people: one FaceData per chip-worthy
+    cluster, membership on every face, links for prominent ones. `old` maps
+    external_id -> the FaceData row it had before; the caller has already
+    cleared these faces' identities. Returns (people, chips) — chips to crop +
+    upload once the transaction commits."""
+    old_names = {eid: fd.name for eid, fd in old.items() if fd.name}
+    people = 0
+    used_ids = set()
+    chips = []  # (external_id, photo_id, bbox) to crop+upload after commit
+    people_rows, links = [], []  # bulk-inserted below
+    assign = []  # {id, face_id} for the bulk embedding update
+    # biggest clusters first so they claim their original person id
+    for members in sorted(clusters, key=len, reverse=True):
+        best = faces[max(members, key=lambda i: face_score(_stored_face(faces[i])))]
+        best_face = _stored_face(best)
+
+        # only surface a person we have a clean, front-facing shot of.
+        # profile / back-of-head / arm-over-face clusters make junk tiles
+        # (you can't tell who it is), so skip them regardless of how many
+        # photos they appear in — the photos stay in the album, just not
+        # pinned to a face tile.
+        if not is_chip_worthy(best_face):
+            continue
+
+        # reuse the person id this cluster mostly came from -> stable ids +
+        # we can skip re-cropping an unchanged chip. fall back to a new id.
+        tally = {}
+        for i in members:
+            oid = faces[i].face_id
+            if oid:
+                tally[oid] = tally.get(oid, 0) + 1
+        external_id = next(
+            (oid for oid, _ in sorted(tally.items(), key=lambda kv: -kv[1])
+             if oid not in used_ids),
+            None,
+        ) or uuid.uuid4().hex
+        used_ids.add(external_id)
+        prev = old.get(external_id)
+
+        inherited = next(
+            (old_names[faces[i].face_id] for i in members
+             if faces[i].face_id in old_names),
+            None,
+        ) if old_names else None
+        # keep a pinned cover sticky; its chip is left untouched since the
+        # person id is reused
+        score = face_score(best_face)
+        pinned = prev is not None and (prev.key_score or 0) >= COVER_LOCK
+        if pinned:
+            score = COVER_LOCK
+
+        people_rows.append(
+            {
+                "external_id": external_id,
+                "name": inherited,
+                "key_score": score,
+                "chip_hash": prev.chip_hash if prev is not None else None,
+            }
+        )
+        linked = set()
+        for i in members:
+            fe = faces[i]
+            # cluster membership (all faces)
+            assign.append({"id": fe.id, "face_id": external_id})
+            # tag the photo only when this person is a real subject in it
+            if fe.photo_id not in linked and _is_prominent(
+                (fe.bbox or {}).get("box"), img_w.get(fe.photo_id)
+            ):
+                linked.add(fe.photo_id)
+                links.append(
+                    {
+                        "photo_id": fe.photo_id,
+                        "face_id": external_id,
+                        "album_id": fe.album_id,
+                    }
+                )
+        people += 1
+        if not pinned:
+            chips.append((external_id, best.photo_id, best_face["bbox"]))
+
+    # face_data rows first (FK), then repoint every member in one bulk
+    # UPDATE by primary key, then the links — one multi-row statement each
+    if people_rows:
+        session.execute(insert(FaceData), people_rows)
+    if assign:
+        session.execute(update(FaceEmbedding), assign)
+    if links:
+        session.execute(insert(PhotoFaceLink), links)
+    return people, chips
+
+
+def _upload_chips(session, chips, old):
+    """Crop + upload key chips on a bounded thread pool. One query resolves
+    every source photo; a chip whose fingerprint matches the stored chip_hash
+    is skipped, and photos supplying several chips are fetched and decoded
+    once (grouped per photo, backed by the _chip_sources LRU). The new
+    hashes are recorded on face_data."""
+    photo_ids = {photo_id for _, photo_id, bbox in chips if bbox}
+    if not photo_ids:
+        return
+    src = {
+        r.id: r
+        for r in session.execute(
+            select(
+                FileMetadata.id,
+                Album.slug,
+                FileMetadata.filename,
+                FileMetadata.upload_date,
+            )
+            .join(Album, Album.id == FileMetadata.album_id)
+            .where(FileMetadata.id.in_(photo_ids))
+        ).all()
+    }
+
+    by_source = {}  # (key, upload_date) -> [(external_id, bbox, hash)]
+    for external_id, photo_id, bbox in chips:
+        row = src.get(photo_id)
+        if not bbox or row is None:
+            continue
+        key = f"{row.slug}/{row.filename}"
+        h = _chip_hash(key, row.upload_date, bbox)
+        prev = old.get(external_id)
+        if prev is not None and prev.chip_hash == h:
+            continue  # chip already there
+        by_source.setdefault((key, row.upload_date), []).append((external_id, bbox, h))
+    if not by_source:
+        return
+
+    def _crop_source(source, items):
+        key = source[0]
+        try:
+            img, scale = _source_image(
+                *source, _chip_scale([bbox for _, bbox, _ in items])
+            )
+        except Exception as e:
+            print(f"recluster: chip source unavailable {key}: {e}")
+            return {}
+        done = {}
+        for external_id, bbox, h in items:
+            try:
+                buf = io.BytesIO()
+                _crop(img, bbox, scale=scale).save(buf, format="JPEG")
+                buf.seek(0)
+                s3_client.upload_fileobj(
+                    buf, AWS_BUCKET, f"faces/{external_id}.jpg",
+                    ExtraArgs={"ContentType": "image/jpeg"},
+                )
+                done[external_id] = h
+            except Exception as e:
+                print(f"recluster: chip upload failed for {key}: {e}")
+        return done
+
+    hashes = {}
+    with ThreadPoolExecutor(max_workers=CHIP_WORKERS) as pool:
+        for done in pool.map(lambda kv: _crop_source(*kv), by_source.items()):
+            hashes.update(done)
+    _set_chip_hashes(session, hashes)
+    session.commit()
 
 
 def recluster_faces():
     """Authoritative clustering: rebuild every person from the full embedding
     graph using Chinese Whispers. Order-independent and chaining-resistant —
     unlike the incremental per-photo matcher. Preserves any names already
-    assigned, repicks each person's sharpest frontal key chip."""
+    assigned, repicks each person's sharpest frontal key chip.
+
+    Cost grows with the whole library; uploads use recluster_photos() and
+    this stays the explicit maintenance pass behind /api/faces/recluster."""
     with session_scope() as session:
-        faces = session.query(FaceEmbedding).all()
+        # one columnar read — no ORM objects; embeddings become a float32 matrix
+        faces = session.execute(select(*_FACE_COLS).order_by(FaceEmbedding.id)).all()
         if not faces:
             return "No faces to cluster."
-        by_id = {fe.id: fe for fe in faces}
-        node_ids = list(by_id.keys())
+        X = face_cluster.unit_rows([fe.embedding for fe in faces])
 
         # photo widths, to judge face prominence when tagging
         img_w = {
@@ -412,70 +786,22 @@ def recluster_faces():
         }
 
         # what each face was assigned to before — lets us keep stable person ids
-        # (and names) across reruns, so re-clustering is cheap and idempotent
-        old_face_of = {fe.id: fe.face_id for fe in faces}
-        all_fd = session.query(FaceData).all()
-        old_names = {fd.external_id: fd.name for fd in all_fd if fd.name}
-        # manually pinned covers (locked key_score) survive reclustering
-        old_scores = {fd.external_id: fd.key_score or 0 for fd in all_fd}
-
-        # edges: each face's nearest neighbours within CLUSTER_DIST (HNSW kNN)
-        sim_min = 1.0 - CLUSTER_DIST
-        rows = session.execute(
-            text(
-                """
-                SELECT a.id AS a, nn.id AS b,
-                       1 - (a.embedding <=> nn.embedding) AS sim
-                FROM face_embedding a
-                CROSS JOIN LATERAL (
-                    SELECT b.id, b.embedding FROM face_embedding b
-                    WHERE b.id <> a.id
-                    ORDER BY b.embedding <=> a.embedding
-                    LIMIT :k
-                ) nn
-                WHERE 1 - (a.embedding <=> nn.embedding) >= :sim_min
-                """
-            ),
-            {"k": CLUSTER_KNN, "sim_min": sim_min},
-        ).fetchall()
-
-        adjacency = {}
-        for a, b, sim in rows:
-            adjacency.setdefault(a, []).append((b, float(sim)))
-            adjacency.setdefault(b, []).append((a, float(sim)))
-
-        labels = _chinese_whispers(node_ids, adjacency)
-
-        # stage 2: centroid merge — reunite pose-split people (frontal vs profile)
-        groups = {}
-        for fid, lbl in labels.items():
-            groups.setdefault(lbl, []).append(fid)
-        glabels = list(groups)
-        if len(glabels) > 1:
-            cent = np.array([
-                _unit(np.mean([by_id[i].embedding for i in groups[g]], axis=0))
-                for g in glabels
-            ])
-            sim = cent @ cent.T
-            parent = list(range(len(glabels)))
-
-            def _find(x):
-                while parent[x] != x:
-                    parent[x] = parent[parent[x]]
-                    x = parent[x]
-                return x
-
-            thr = 1.0 - CENTROID_MERGE_DIST
-            for i in range(len(glabels)):
-                for j in range(i + 1, len(glabels)):
-                    if sim[i, j] >= thr:
-                        parent[_find(i)] = _find(j)
-            remap = {g: glabels[_find(i)] for i, g in enumerate(glabels)}
-            labels = {fid: remap[lbl] for fid, lbl in labels.items()}
-
-        clusters = {}
-        for fid, lbl in labels.items():
-            clusters.setdefault(lbl, []).append(fid)
+        # (and names) across reruns, so re-clustering is cheap and idempotent.
+        # manually pinned covers (locked key_score) survive reclustering, and
+        # chip_hash lets unchanged chips skip the re-crop
+        old = {
+            r.external_id: r
+            for r in session.execute(
+                select(
+                    FaceData.external_id,
+                    FaceData.name,
+                    FaceData.key_score,
+                    FaceData.chip_hash,
+                )
+            ).all()
+        }
+
+        clusters = _cluster(X)
 
         # wipe old identities; embeddings stay, face_id gets rewritten.
         # null the FK references before dropping face_data rows.
@@ -486,106 +812,155 @@ def recluster_faces():
         session.query(FaceData).delete()
         session.flush()
 
-        people = 0
-        used_ids = set()
-        chips = []  # (external_id, photo_id, bbox, is_new) to crop+upload after commit
-        # biggest clusters first so they claim their original person id
-        for members in sorted(clusters.values(), key=len, reverse=True):
-            best_id = max(members, key=lambda i: face_score(_stored_face(by_id[i])))
-            best = by_id[best_id]
-            best_face = _stored_face(best)
-
-            # only surface a person we have a clean, front-facing shot of.
-            # profile / back-of-head / arm-over-face clusters make junk tiles
-            # (you can't tell who it is), so skip them regardless of how many
-            # photos they appear in — the photos stay in the album, just not
-            # pinned to a face tile.
-            if not is_chip_worthy(best_face):
-                continue
+        people, chips = _write_people(session, faces, clusters, img_w, old)
+        session.commit()
+        # the live tagger matches against the identities we just wrote
+        matcher.load(session)
+
+        _upload_chips(session, chips, old)
+
+    print(f"recluster_faces: {people} people from {len(faces)} faces")
+    return f"{people} people"
 
-            # reuse the person id this cluster mostly came from -> stable ids +
-            # we can skip re-cropping an unchanged chip. fall back to a new id.
-            tally = {}
-            for i in members:
-                oid = old_face_of.get(i)
-                if oid:
-                    tally[oid] = tally.get(oid, 0) + 1
-            external_id = next(
-                (oid for oid, _ in sorted(tally.items(), key=lambda kv: -kv[1])
-                 if oid not in used_ids),
-                None,
-            ) or uuid.uuid4().hex
-            is_new = external_id not in old_names and external_id not in tally
-            used_ids.add(external_id)
-
-            inherited = next(
-                (old_names[old_face_of[i]] for i in members
-                 if old_face_of.get(i) in old_names),
-                None,
-            ) if old_names else None
-            # keep a pinned cover sticky; the existing chip is left untouched
-            # below (head_object skip) since the person id is reused
-            score = face_score(best_face)
-            if old_scores.get(external_id, 0) >= COVER_LOCK:
-                score = COVER_LOCK
-
-            session.add(
-                FaceData(external_id=external_id, name=inherited, key_score=score)
+
+# rounds of "did the merge reach a person outside the region?" before we stop
+# growing it; in practice one extra round is already rare
+RECLUSTER_EXPAND_ROUNDS = 3
+
+
+def _touched_people(session, photo_ids):
+    """Persons and parked faces near the given photos' faces: each face's own
+    person plus whoever its CLUSTER_KNN nearest neighbours (within
+    CLUSTER_DIST) belong to. One HNSW probe per *new* face, not per face in
+    the library. Returns (person ids, ids of unassigned neighbour faces)."""
+    rows = session.execute(
+        text(
+            """
+            SELECT s.face_id AS own, nn.id, nn.face_id
+            FROM face_embedding s
+            CROSS JOIN LATERAL (
+                SELECT b.id, b.face_id, b.embedding FROM face_embedding b
+                WHERE b.id <> s.id
+                ORDER BY b.embedding <=> s.embedding
+                LIMIT :k
+            ) nn
+            WHERE s.photo_id = ANY(:ids)
+              AND 1 - (s.embedding <=> nn.embedding) >= :sim_min
+            """
+        ),
+        {"ids": list(photo_ids), "k": CLUSTER_KNN, "sim_min": 1.0 - CLUSTER_DIST},
+    ).fetchall()
+    people, parked = set(), set()
+    for own, nid, nface in rows:
+        if own:
+            people.add(own)
+        if nface:
+            people.add(nface)
+        else:
+            parked.add(nid)
+    # seeds with no neighbour in range still carry their live-tagged person
+    people.update(
+        r[0]
+        for r in session.query(FaceEmbedding.face_id)
+        .filter(
+            FaceEmbedding.photo_id.in_(photo_ids),
+            FaceEmbedding.face_id.isnot(None),
+        )
+        .distinct()
+    )
+    return people, parked
+
+
+def recluster_photos(photo_ids, people=()):
+    """Incremental recluster after an upload or resync: re-label only the part
+    of the graph the given photos' faces touch, leaving every other person
+    and link exactly as it was.
+
+    The region is the new faces, the people they (or their nearest
+    neighbours) belong to, nearby parked faces, plus `people` — persons the
+    caller already knows were affected (e.g. ones whose faces a resync just
+    deleted). It's clustered with the same engine as recluster_faces(); if a
+    region cluster's centroid lands within CENTROID_MERGE_DIST of a person
+    outside the region, that person joins and the region is redone, so
+    pose-split people still reunite."""
+    photo_ids = list(photo_ids)
+    if not photo_ids and not people:
+        return "Nothing to recluster."
+    with session_scope() as session:
+        touched, parked = (
+            _touched_people(session, photo_ids) if photo_ids else (set(), set())
+        )
+        touched.update(people)
+
+        for round_ in range(RECLUSTER_EXPAND_ROUNDS + 1):
+            faces = session.execute(
+                select(*_FACE_COLS)
+                .where(
+                    FaceEmbedding.photo_id.in_(photo_ids)
+                    | FaceEmbedding.face_id.in_(list(touched))
+                    | FaceEmbedding.id.in_(list(parked))
+                )
+                .order_by(FaceEmbedding.id)
+            ).all()
+            if not faces:
+                # everything in the region is gone — just drop the emptied people
+                clusters = []
+                break
+            X = face_cluster.unit_rows([fe.embedding for fe in faces])
+            clusters = _cluster(X)
+            if round_ == RECLUSTER_EXPAND_ROUNDS:
+                break
+
+            # any person outside the region close enough to merge with one of
+            # our clusters? pull them in and cluster again
+            ids, cent = matcher.centroids(session)
+            grown = face_cluster.expand_region(
+                X, clusters, ids, cent, touched, CENTROID_MERGE_DIST
             )
-            linked = set()
-            for i in members:
-                fe = by_id[i]
-                fe.face_id = external_id  # cluster membership (all faces)
-                # tag the photo only when this person is a real subject in it
-                if fe.photo_id not in linked and _is_prominent(
-                    (fe.bbox or {}).get("box"), img_w.get(fe.photo_id)
-                ):
-                    linked.add(fe.photo_id)
-                    session.add(
-                        PhotoFaceLink(
-                            photo_id=fe.photo_id,
-                            face_id=external_id,
-                            album_id=fe.album_id,
-                        )
-                    )
-            people += 1
-            chips.append((external_id, best.photo_id, best_face["bbox"], is_new))
+            if grown == touched:
+                break
+            touched = grown
+
+        region_photos = {fe.photo_id for fe in faces}
+        img_w = {
+            pid: w
+            for pid, w in session.query(FileMetadata.id, FileMetadata.width)
+            .filter(FileMetadata.id.in_(list(region_photos)))
+            .all()
+        }
+        old = {
+            r.external_id: r
+            for r in session.execute(
+                select(
+                    FaceData.external_id,
+                    FaceData.name,
+                    FaceData.key_score,
+                    FaceData.chip_hash,
+                ).where(FaceData.external_id.in_(list(touched)))
+            ).all()
+        }
+
+        # wipe just the region's identities (FK refs first, as in the full pass)
+        session.query(FaceEmbedding).filter(
+            FaceEmbedding.id.in_([fe.id for fe in faces])
+        ).update({FaceEmbedding.face_id: None}, synchronize_session=False)
+        session.query(PhotoFaceLink).filter(
+            PhotoFaceLink.face_id.in_(list(touched))
+        ).delete(synchronize_session=False)
+        session.query(FaceData).filter(
+            FaceData.external_id.in_(list(touched))
+        ).delete(synchronize_session=False)
+        session.flush()
 
+        people_n, chips = _write_people(session, faces, clusters, img_w, old)
         session.commit()
+        # identities changed under the live tagger; it reloads on next use
+        matcher.invalidate()
 
-        # crop + upload key chips. skip ones that already exist (reused person,
-        # chip still valid) so reruns stay cheap.
-        for external_id, photo_id, bbox, is_new in chips:
-            if not bbox:
-                continue
-            if not is_new:
-                try:
-                    s3_client.head_object(Bucket=AWS_BUCKET, Key=f"faces/{external_id}.jpg")
-                    continue  # chip already there
-                except Exception:
-                    pass
-            row = (
-                session.query(Album.slug, FileMetadata.filename)
-                .join(FileMetadata, FileMetadata.album_id == Album.id)
-                .filter(FileMetadata.id == photo_id)
-                .first()
-            )
-            if not row:
-                continue
-            key = f"{row.slug}/{row.filename}"
-            try:
-                img = Image.open(
-                    io.BytesIO(s3_client.get_object(Bucket=AWS_BUCKET, Key=key)["Body"].read())
-                ).convert("RGB")
-                buf = io.BytesIO()
-                _crop(img, bbox).save(buf, format="JPEG")
-                buf.seek(0)
-                s3_client.upload_fileobj(
-                    buf, AWS_BUCKET, f"faces/{external_id}.jpg",
-                    ExtraArgs={"ContentType": "image/jpeg"},
-                )
-            except Exception as e:
-                print(f"recluster: chip upload failed for {key}: {e}")
+        _upload_chips(session, chips, old)
 
-    print(f"recluster_faces: {people} people from {len(node_ids)} faces")
-    return f"{people} people"
+    print(
+        f"recluster_photos: {people_n} people from {len(faces)} faces "
+        f"({len(touched)} touched)"
+    )
+    return f"{people_n} people"
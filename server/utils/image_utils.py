@@ -2,55 +2,209 @@ from PIL import Image
 import PIL.ExifTags
 import base64
 import io
+import json
+import math
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
 import os 
+import threading
 
-def rotate_image_based_on_exif(img):
-    try:
-        # Loop through all the tags in the image's EXIF data
-        for orientation in PIL.ExifTags.TAGS.keys():
-            if PIL.ExifTags.TAGS[orientation] == "Orientation":
-                break
-
-        # Get the EXIF data from the image
-        exif = dict(img._getexif().items())
-
-        # Rotate the image based on the orientation
-        if exif[orientation] == 3:
-            img = img.rotate(180, expand=True)
-        elif exif[orientation] == 6:
-            img = img.rotate(270, expand=True)
-        elif exif[orientation] == 8:
-            img = img.rotate(90, expand=True)
-
-    except (AttributeError, KeyError, IndexError):
-        # If there was an error reading the EXIF data, do nothing
-        pass
+# HEIC/HEIF support is optional: with pillow_heif installed PIL can open
+# iPhone originals, and reduced loads use their embedded thumbnails
+try:
+    import pillow_heif
+
+    pillow_heif.register_heif_opener()
+    _heif_thumbnail = getattr(pillow_heif, "thumbnail", None)
+except ImportError:
+    _heif_thumbnail = None
+
+
+# EXIF orientation -> counter-clockwise degrees to stand the image upright
+_EXIF_ROTATE = {3: 180, 6: 270, 8: 90}
 
+# blur placeholder: 10x10, decoded from the smallest JPEG DCT scale that still
+# covers BLUR_DRAFT (a 50 MP frame comes out at 1/8 scale, not full size)
+BLUR_SIZE = (10, 10)
+BLUR_DRAFT = (80, 80)
+
+_BLUR_FALLBACK = (
+    "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAYEBQYFBAYGBQYHBwYIChAKCgkJChQODwwQFxQYGBcUFhYaHSUfGhsjHBYWICwgIyYnKSopGR8tMC0oMCUoKSj/2wBDAQcHBwoIChMKChMoGhYaKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCj/wAARCAABAAEDAREAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAv/xAAhEAACAQMDBQAAAAAAAAAAAAABAgMABAUGIWGRkqGx0f/EABUBAQEAAAAAAAAAAAAAAAAAAAMF/8QAGhEAAgIDAAAAAAAAAAAAAAAAAAECEgMRkf/aAAwDAQACEQMRAD8AltJagyeH0AthI5xdrLcNM91BF5pX2HaH9bcfaSXWGaRmknyJckliyjqTzSlCyQhQTlUYfmvzaGBg="
+)
+
+
+def _reduce(img, min_size):
+    """Ask the decoder for the smallest scale that still covers min_size
+    (w, h): an embedded HEIC thumbnail, or JPEG DCT scaling (1/2, 1/4, 1/8)
+    via draft(). Must run before the pixels are loaded; other formats decode
+    at full size as before."""
+    if _heif_thumbnail and img.format in ("HEIF", "AVIF"):
+        img = _heif_thumbnail(img, min_box=max(min_size))
+    img.draft("RGB", min_size)
     return img
 
-def generate_blur_data_url(image_content):
-    try:
-        image = Image.open(io.BytesIO(image_content))
 
-        # Convert to RGB if necessary (handles RGBA, P, etc.)
-        if image.mode not in ("RGB", "L"):
-            image = image.convert("RGB")
+def load_image(source, min_size=None, scale=None):
+    """Decode an image (bytes, file object or path) as RGB, only as large as
+    needed: at least min_size (w, h), or at least `scale` x the full size.
+    Returns (image, actual_scale) — multiply full-resolution coordinates (face
+    boxes) by actual_scale to address the returned image. EXIF orientation is
+    not applied."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    full_w = img.width
+    if scale is not None and scale < 1:
+        min_size = (math.ceil(img.width * scale), math.ceil(img.height * scale))
+    if min_size:
+        img = _reduce(img, min_size)
+    img = img.convert("RGB") if img.mode != "RGB" else img
+    img.load()
+    return img, img.width / full_w
+
+
+def _read_exif(img):
+    """Header-only EXIF read (no pixel decode) as {tag name: value}."""
+    exif = img._getexif() if hasattr(img, "_getexif") else None
+    exif_data = {}
+    if exif:
+        for tag, value in exif.items():
+            decoded = PIL.ExifTags.TAGS.get(tag, tag)
+            if isinstance(value, (int, float, str, list, dict, tuple)):
+                exif_data[decoded] = value
+    return exif_data
+
+
+def exif_capture_time(exif_data):
+    """EXIF DateTimeOriginal (then DateTime) as a datetime, or None. Takes the
+    decoded tag dict or its JSON string as stored in file_metadata."""
+    if isinstance(exif_data, str):
+        try:
+            exif_data = json.loads(exif_data)
+        except Exception:
+            return None
+    if isinstance(exif_data, dict):
+        dt = exif_data.get("DateTimeOriginal") or exif_data.get("DateTime")
+        if dt:
+            try:
+                return datetime.strptime(str(dt), "%Y:%m:%d %H:%M:%S")
+            except Exception:
+                pass
+    return None
+
+
+def _blur_placeholder(image, exif_orientation=1):
+    """Tiny blurred JPEG data URL from an opened (not yet decoded) image."""
+    image = _reduce(image, BLUR_DRAFT)
+
+    # Convert to RGB if necessary (handles RGBA, P, etc.)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
 
-        # Rotate based on EXIF orientation
-        image = rotate_image_based_on_exif(image)
+    # Rotate based on EXIF orientation
+    if exif_orientation in _EXIF_ROTATE:
+        image = image.rotate(_EXIF_ROTATE[exif_orientation], expand=True)
 
-        # Create small blurred version
-        image = image.resize((10, 10), Image.Resampling.LANCZOS)
+    # Create small blurred version
+    image = image.resize(BLUR_SIZE, Image.Resampling.LANCZOS)
 
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG", quality=85)
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=85)
 
-        # Return data URL format
-        encoded_img = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return f"data:image/jpeg;base64,{encoded_img}"
+    # Return data URL format
+    encoded_img = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return f"data:image/jpeg;base64,{encoded_img}"
 
+
+def render_blur_data_url(image_content):
+    """Blur placeholder for an encoded image (bytes or a file object). Raises
+    if it can't be decoded."""
+    if isinstance(image_content, (bytes, bytearray)):
+        image_content = io.BytesIO(image_content)
+    image = Image.open(image_content)
+    return _blur_placeholder(image, _read_exif(image).get("Orientation", 1))
+
+
+def inspect_image(content):
+    """Everything an upload records about an image, from its encoded bytes
+    (or the path of a file holding them): size, exif (JSON), capture time,
+    EXIF-rotated width/height, orientation and the blur placeholder. One
+    open: the header gives exif and dimensions without decoding pixels, and
+    the blur decodes at reduced scale. Pure PIL and picklable in/out, so
+    ingest can run it on a process pool."""
+    if isinstance(content, str):
+        size = os.path.getsize(content)
+        img = Image.open(content)
+    else:
+        size = len(content)
+        img = Image.open(io.BytesIO(content))
+    exif_data = _read_exif(img)
+    exif_orientation = exif_data.get("Orientation", 1)
+
+    # size comes from the header; read it before draft() rescales it
+    width, height = img.size
+    # EXIF orientation 5-8 means the image is rotated 90°, so swap w/h
+    if exif_orientation in (5, 6, 7, 8):
+        width, height = height, width
+
+    if height > width:
+        orientation = "portrait"
+    elif width > height:
+        orientation = "landscape"
+    else:
+        orientation = "square"
+
+    try:
+        blur = _blur_placeholder(img, exif_orientation)
     except Exception as e:
         print(f"Error generating blur data URL: {e}")
-        # Return a minimal 1x1 transparent placeholder
-        return "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAYEBQYFBAYGBQYHBwYIChAKCgkJChQODwwQFxQYGBcUFhYaHSUfGhsjHBYWICwgIyYnKSopGR8tMC0oMCUoKSj/2wBDAQcHBwoIChMKChMoGhYaKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCj/wAARCAABAAEDAREAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAv/xAAhEAACAQMDBQAAAAAAAAAAAAABAgMABAUGIWGRkqGx0f/EABUBAQEAAAAAAAAAAAAAAAAAAAMF/8QAGhEAAgIDAAAAAAAAAAAAAAAAAAECEgMRkf/aAAwDAQACEQMRAD8AltJagyeH0AthI5xdrLcNM91BF5pX2HaH9bcfaSXWGaRmknyJckliyjqTzSlCyQhQTlUYfmvzaGBg="
+        blur = _BLUR_FALLBACK
+
+    return {
+        "size": size,
+        "exif_data": json.dumps(exif_data, default=str),
+        "captured_at": exif_capture_time(exif_data),
+        "width": width,
+        "height": height,
+        "orientation": orientation,
+        "blur_data_url": blur,
+    }
+
+
+def image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageLRU:
+    """Decoded images keyed by source, evicted least-recently-used once their
+    pixel data passes max_bytes. Thread-safe; an image bigger than the whole
+    budget is returned without being cached. Pass `sizeof` when the cached
+    values aren't bare images (e.g. load_image's (image, scale))."""
+
+    def __init__(self, max_bytes, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Cached image for `key`, calling `load()` to decode it on a miss."""
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+                return img
+        img = load()
+        size = self._sizeof(img)
+        if size > self.max_bytes:
+            return img
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = img
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, old = self._items.popitem(last=False)
+                    self._bytes -= self._sizeof(old)
+        return img